@@ -1,5 +1,59 @@
+import functools
 import click
-import noiserun
+
+# The model modules are imported inside the commands that need them, so that --help,
+# validate and info start without loading the noise model
+
+INPUTS = "noisedata/WHS2 Noise Analysis 2025 - "
+
+def model_options(func):
+    # Options for the barrier, source and param input files. serve has only these, taking
+    # its receptors from the queries
+    func = click.option("--params", "params_csv", default=f"{INPUTS}Params.csv", show_default=True, help="Params CSV.")(func)
+    func = click.option("--sources", "sources_csv", default=f"{INPUTS}Sources.csv", show_default=True, help="Source sets CSV.")(func)
+    func = click.option("--barriers", "barriers_csv", default=f"{INPUTS}Barriers.csv", show_default=True, help="Barriers CSV.")(func)
+    return func
+
+def input_options(func):
+    # Options for the four input files shared by run, validate, info and the other commands
+    # over the receptors
+    func = model_options(func)
+    func = click.option("--receptors", "receptors_csv", default=f"{INPUTS}Receptors.csv", show_default=True, help="Receptors CSV.")(func)
+    return func
+
+def sectors_option(values, option: str) -> set:
+    # Sector selections of an option, with a usage error for a malformed one
+    from noisetrace import parse_sectors
+    try:
+        return parse_sectors(values)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint=option)
+
+def selection_options(func):
+    # Options selecting part of the run matrix, shared by run and profile. The command is
+    # called with a Selection built from them as `selection`.
+    @functools.wraps(func)
+    def wrapper(*args, only_receptor, skip_receptor, only_param, skip_param, only_variant, skip_variant, sector, **kwargs):
+        from noiseselect import Selection
+        kwargs["selection"] = Selection(
+            receptors=only_receptor,
+            exclude_receptors=skip_receptor,
+            params=only_param,
+            exclude_params=skip_param,
+            variants=only_variant,
+            exclude_variants=skip_variant,
+            sectors=sectors_option(sector, "--sector"),
+        )
+        return func(*args, **kwargs)
+
+    wrapper = click.option("--sector", multiple=True, help="Only evaluate these train position sectors, e.g. 10, 10-20 or -20 (from sector 0).")(wrapper)
+    wrapper = click.option("--skip-variant", multiple=True, metavar="PATTERN", help="Skip sensitivity variants matching these patterns.")(wrapper)
+    wrapper = click.option("--only-variant", multiple=True, metavar="PATTERN", help="Only run sensitivity variants matching these patterns, from all variants unless --variant is given.")(wrapper)
+    wrapper = click.option("--skip-param", multiple=True, metavar="PATTERN", help="Skip params matching these patterns.")(wrapper)
+    wrapper = click.option("--only-param", multiple=True, metavar="PATTERN", help="Only run params matching these patterns.")(wrapper)
+    wrapper = click.option("--skip-receptor", multiple=True, metavar="PATTERN", help="Skip receptors matching these patterns.")(wrapper)
+    wrapper = click.option("--only-receptor", multiple=True, metavar="PATTERN", help="Only run receptors matching these patterns, e.g. R1*.")(wrapper)
+    return wrapper
 
 @click.group()
 def cli():
@@ -7,15 +61,272 @@ def cli():
     pass
 
 @cli.command()
-def todo():
+@input_options
+@click.option("--outdir", default="noisedata", show_default=True, help="Directory for the outputs, logs and checkpoints.")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv", show_default=True, help="Output format.")
+@click.option("--workers", type=int, default=1, show_default=True, help="Number of worker processes.")
+@click.option("--influence", type=float, default=None, help="Only run each receptor against params whose track comes within this many metres of it.")
+@click.option("--chunk-size", type=int, default=None, help="Stream the receptors through the run in chunks of this many.")
+@click.option("--max-memory", default=None, help="Memory budget, e.g. 2G. Chooses chunk sizes and workers to stay within it.")
+@click.option("--variant", multiple=True, help="Sensitivity variant to run, or all. Defaults to the built in list.")
+@selection_options
+@click.option("--timetable", "timetable_csv", default=None, help="Timetable CSV of passes to aggregate into LAeq and Lden.")
+@click.option("--backend", default="scalar", show_default=True, help="Compute backend for the noise model (scalar, reference, or lod[:RATIO] to interpolate between distant train positions).")
+@click.option("--resume", "resume", metavar="RUN_ID", default=None, help="Resume an interrupted run from its checkpoint.")
+@click.option("--trace", is_flag=True, help="Write a structured trace of the model terms.")
+@click.option("--trace-receptor", multiple=True, help="Only trace these receptors.")
+@click.option("--trace-param", multiple=True, help="Only trace these params.")
+@click.option("--trace-variant", multiple=True, help="Only trace these sensitivity variants (_baseline for the base run).")
+@click.option("--trace-sector", multiple=True, help="Only trace these sectors, e.g. 10, 10-20 or -20 (from sector 0).")
+@click.option("--instrument", is_flag=True, help="Count calls in the model's hot paths for the stats report.")
+def run(receptors_csv, barriers_csv, sources_csv, params_csv, outdir, fmt, workers, influence, chunk_size, max_memory, variant, selection,
+        timetable_csv, backend, resume, trace, trace_receptor, trace_param, trace_variant, trace_sector, instrument):
+    """
+    Run the noise model over every receptor and param
+
+    Example: whs2utils run --outdir out --workers 4 --variant up_360kph --variant down_360kph
+    Example: whs2utils run --resume 20250828120000
+    Example: whs2utils run --only-receptor R1 --only-param 'P*' --skip-variant 'tlen_*' --sector 40-60
+    Example: whs2utils run --timetable timetable.csv
+    Example: whs2utils run --receptors addresses.csv --chunk-size 10000 --influence 2000
+    Example: whs2utils run --receptors addresses.csv --max-memory 2G --workers 8
+    Example: whs2utils run --trace --trace-receptor R1 --trace-sector 40-60
+    """
+    import noiserun
+
+    filters = None
+    if trace or trace_receptor or trace_param or trace_variant or trace_sector:
+        filters = dict(
+            receptors=trace_receptor,
+            params=trace_param,
+            variants=trace_variant,
+            sectors=sectors_option(trace_sector, "--trace-sector"),
+        )
+
+    noiserun.run(
+        resume=resume,
+        trace=filters,
+        instrument=instrument,
+        backend=backend,
+        receptors_csv=receptors_csv,
+        barriers_csv=barriers_csv,
+        sources_csv=sources_csv,
+        params_csv=params_csv,
+        outdir=outdir,
+        fmt=fmt,
+        workers=workers,
+        chunk_size=chunk_size,
+        max_memory=max_memory,
+        influence=influence,
+        variants=list(variant) if variant else None,
+        timetable_csv=timetable_csv,
+        selection=selection,
+    )
+
+@cli.command()
+@input_options
+def validate(receptors_csv, barriers_csv, sources_csv, params_csv):
+    """
+    Check the input files without running the model
+
+    Example: whs2utils validate --params params.csv
+    """
+    from noiseio import validate_inputs
+
+    problems = validate_inputs(receptors_csv, barriers_csv, sources_csv, params_csv)
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print("Inputs are valid")
+
+@cli.command()
+@input_options
+def info(receptors_csv, barriers_csv, sources_csv, params_csv):
+    """
+    Summarise the input files and the size of a run
+
+    Example: whs2utils info
     """
-    Stub click command
+    from noiseio import load_receptors_csv, load_barriers_csv, load_sourcesets_csv, load_params_csv
+
+    receptors = load_receptors_csv(receptors_csv)
+    barriers = load_barriers_csv(barriers_csv, angles=False)
+    sourcesets = load_sourcesets_csv(sources_csv)
+    params = load_params_csv(params_csv, barriers, sourcesets)
+
+    print(f"{len(receptors)} receptors")
+    print(f"{len(barriers)} barriers")
+    for b in barriers.values():
+        print(f"  {b.key}: {len(b.bht)} sectors of {b.slen}m")
+    print(f"{len(sourcesets)} sourcesets")
+    print(f"{len(params)} params")
+    for p in params.values():
+        print(f"  {p.key}: v{p.v} {p.dirn} {p.kph}kph {p.tlen}m barriers {p.barrier1.key}/{p.barrier2.key}")
+    sectors = sum(len(p.barrier1.bht) for p in params.values())
+    print(f"{len(receptors) * len(params)} base scenarios, {len(receptors) * sectors} scenario-sectors")
+
+@cli.command()
+@model_options
+@click.option("--host", default="127.0.0.1", show_default=True, help="Address to listen on.")
+@click.option("--port", type=int, default=8765, show_default=True, help="Port to listen on.")
+@click.option("--backend", default="scalar", show_default=True, help="Compute backend for the noise model.")
+@click.option("--window", type=float, default=5.0, show_default=True, help="Milliseconds to gather concurrent queries into a batch.")
+@click.option("--cache-size", type=int, default=10000, show_default=True, help="Number of evaluated scenarios to keep.")
+@click.option("--tiles", default=None, help="Serve noise map tiles under /tiles/, made on request and kept in this directory.")
+@click.option("--levels", type=int, default=6, show_default=True, help="Zoom levels of the tile pyramids.")
+@click.option("--influence", type=float, default=None, help="Only evaluate tiles against params whose track comes within this many metres.")
+@click.option("--direct", is_flag=True, help="Always evaluate lower zoom tiles at their own resolution, rather than deriving them from the zoom above where it is already made.")
+@click.option("--tile-timeout", type=float, default=10.0, show_default=True, help="Seconds to wait for a tile being made before answering 202 pending, to be asked for again.")
+def serve(barriers_csv, sources_csv, params_csv, host, port, backend, window, cache_size, tiles, levels, influence, direct, tile_timeout):
+    """
+    Answer noise queries over localhost HTTP with the inputs loaded once
+
+    Example: whs2utils serve --port 8765
+    Example: whs2utils serve --tiles noisedata/tiles --levels 8 --influence 2000
+    """
+    import noiseserve
+
+    service = noiseserve.NoiseService(barriers_csv, sources_csv, params_csv,
+                                      backend=backend, window=window / 1000, cache_size=cache_size,
+                                      tiles=tiles, levels=levels, influence=influence, direct=direct,
+                                      tile_timeout=tile_timeout)
+    noiseserve.serve(service, host, port)
+
+@cli.command()
+@input_options
+@click.option("--barrier", required=True, help="Key of the barrier to design.")
+@click.option("--target", type=float, required=True, help="Highest maxdb allowed at each receptor.")
+@click.option("--receptor", multiple=True, help="Only design for these receptors. Defaults to all.")
+@click.option("--param", multiple=True, help="Only design for these params. Defaults to all using the barrier.")
+@click.option("--step", type=float, default=0.5, show_default=True, help="Height step in metres.")
+@click.option("--max-height", type=float, default=8.0, show_default=True, help="Highest barrier allowed in metres.")
+@click.option("--outdir", default="noisedata", show_default=True, help="Directory for the designed barrier and report.")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv", show_default=True, help="Report format.")
+def optimize(receptors_csv, barriers_csv, sources_csv, params_csv, barrier, target, receptor, param, step, max_height, outdir, fmt):
+    """
+    Search the sector heights of a barrier for the least area meeting a target maxdb
+
+    The designed barrier is written in the barriers CSV layout, ready to run.
+
+    Example: whs2utils optimize --barrier b1 --target 65 --receptor R1 --receptor R2
+    """
+    import noiseoptimize
+
+    noiseoptimize.optimize(barrier, target, receptors_csv, barriers_csv, sources_csv, params_csv,
+                           receptor_keys=receptor, param_keys=param, step=step, max_height=max_height,
+                           outdir=outdir, fmt=fmt)
+
+@cli.command()
+@input_options
+@selection_options
+@click.option("--variant", multiple=True, help="Sensitivity variant to profile, or all. Defaults to the built in list.")
+@click.option("--backend", default="scalar", show_default=True, help="Compute backend for the noise model (scalar, reference, or lod[:RATIO] to interpolate between distant train positions).")
+@click.option("--outdir", default="noisedata", show_default=True, help="Directory the profile-RUN folder is written to.")
+@click.option("--top", type=int, default=25, show_default=True, help="Number of functions and allocation sites to report per stage.")
+@click.option("--frames", type=int, default=16, show_default=True, help="Stack depth recorded for each allocation.")
+def profile(receptors_csv, barriers_csv, sources_csv, params_csv, selection, variant, backend, outdir, top, frames):
+    """
+    Profile CPU time and allocations for each stage of a run
+
+    Writes pstats, collapsed stacks for flame graph viewers and a text report per
+    stage (load, getAngles, runscenario, runsensitivity, write).
+
+    Example: whs2utils profile --only-receptor R1 --variant tlen_200 --backend reference
+    """
+    import noiseprofile
+
+    noiseprofile.profile(receptors_csv, barriers_csv, sources_csv, params_csv, selection=selection,
+                         variants=list(variant) if variant else None, backend=backend, outdir=outdir,
+                         top=top, frames=frames)
+
+@cli.command()
+@input_options
+@click.option("--layer", multiple=True, help="Param to map, or max for the highest level over all of them. Defaults to max.")
+@click.option("--zoom", type=int, default=None, help="Make tiles down to this zoom. Defaults to the highest.")
+@click.option("--levels", type=int, default=6, show_default=True, help="Zoom levels in the pyramid.")
+@click.option("--size", type=int, default=256, show_default=True, help="Tile width and height in pixels.")
+@click.option("--bbox", nargs=4, type=float, default=None, metavar="XMIN YMIN XMAX YMAX", help="Only make the tiles over this region.")
+@click.option("--margin", type=float, default=1000.0, show_default=True, help="Metres either side of the track the map covers.")
+@click.option("--influence", type=float, default=None, help="Only evaluate tiles against params whose track comes within this many metres.")
+@click.option("--direct", is_flag=True, help="Always evaluate lower zooms at their own resolution, rather than deriving them from the zoom above.")
+@click.option("--backend", default="scalar", show_default=True, help="Compute backend for the noise model (scalar, reference, or lod[:RATIO] to interpolate between distant train positions).")
+@click.option("--outdir", default="noisedata", show_default=True, help="Directory the tiles/LAYER folders are written to.")
+@click.option("--format", "fmt", type=click.Choice(["png", "f32"]), default="png", show_default=True, help="Colour banded PNG tiles as well as float32, or float32 only.")
+def tiles(receptors_csv, barriers_csv, sources_csv, params_csv, layer, zoom, levels, size, bbox, margin, influence,
+          direct, backend, outdir, fmt):
+    """
+    Export noise map tiles at several zoom levels for web mapping
+
+    Tiles already made are reused unless the inputs of the params reaching them have changed.
+
+    Example: whs2utils tiles --layer max --levels 8 --zoom 4 --influence 2000
+    """
+    import noisetiles
+
+    noisetiles.export(barriers_csv, sources_csv, params_csv, layers=layer or ("max",), zoom=zoom, levels=levels,
+                      size=size, bbox=bbox, margin=margin, influence=influence, direct=direct, backend=backend,
+                      outdir=outdir, fmt=fmt)
+
+@cli.command()
+@click.option("--scale", type=click.Choice(["small", "medium", "corridor"]), default="small", help="Size of the synthetic inputs.")
+@click.option("--seed", type=int, default=0, help="Seed for the synthetic inputs.")
+@click.option("--only", multiple=True, help="Only run these benchmarks, e.g. getNoise2.")
+@click.option("--record", default="benchmarks.jsonl", help="JSON lines file the results are compared with and appended to.")
+@click.option("--label", default="", help="Label for the recorded results, e.g. a version.")
+@click.option("--no-memory", is_flag=True, help="Skip the peak memory pass.")
+def bench(scale, seed, only, record, label, no_memory):
+    """
+    Benchmark the noise model on synthetic inputs
+
+    Example: whs2utils bench --scale medium --label 0.1.0
+    """
+    import noisebench
+
+    noisebench.bench(scale=scale, seed=seed, only=only, record=record, label=label, memory=not no_memory)
+
+@cli.command()
+@click.option("--backend", required=True, help="Compute backend to compare with the reference.")
+@click.option("--scale", type=click.Choice(["small", "medium", "corridor"]), default="small", help="Size of the synthetic inputs.")
+@click.option("--seed", type=int, multiple=True, default=[0], help="Seeds for the synthetic inputs.")
+@click.option("--inputs", nargs=4, default=None, metavar="RECEPTORS BARRIERS SOURCES PARAMS", help="Verify over these CSV files as well.")
+def verify(backend, scale, seed, inputs):
+    """
+    Compare a compute backend with the reference model
+
+    Example: whs2utils verify --backend scalar --scale medium --seed 0 --seed 1
+    """
+    import noiseverify
+
+    passed = noiseverify.print_report(backend, noiseverify.verify_synthetic(backend, scale, seed))
+    if inputs:
+        passed = noiseverify.print_report(backend, noiseverify.verify_files(backend, *inputs)) and passed
+    if not passed:
+        raise SystemExit(1)
+
+@cli.command()
+@click.argument("run_a")
+@click.argument("run_b")
+@click.option("--outdir", default="noisedata", show_default=True, help="Directory the runs were written to.")
+@click.option("--tolerance", type=float, default=0.01, show_default=True, help="Smallest change in dB reported.")
+@click.option("--top", type=int, default=20, show_default=True, help="Number of largest increases listed per output.")
+@click.option("--output", default=None, help="CSV file to write every changed row to.")
+@click.option("--max-rows", type=int, default=100000, show_default=True,
+              help="Most rows held in memory at once, waiting to be paired or sorted, at up to about 2KB a row "
+                   "(200MB at the default). Outputs whose rows are further out of order than this are sorted on disk.")
+def diff(run_a, run_b, outdir, tolerance, top, output, max_rows):
+    """
+    Compare the impacts, results and sresults of two runs
+
+    RUN_A and RUN_B are run ids in OUTDIR, or path prefixes such as old/20240101120000.
 
-    Example: whs2utils todo
+    Example: whs2utils diff 20240101120000 20240102120000 --tolerance 0.1 --output changes.csv
     """
-    print('Welcome to whs2utils')
+    import noisediff
 
-    noiserun.run()
+    if max_rows < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--max-rows")
+    noisediff.diff(run_a, run_b, outdir=outdir, tolerance=tolerance, top=top, output=output, limit=max_rows)
 
 if __name__ == "__main__":
-    todo()
+    cli()
@@ -0,0 +1,94 @@
+import copy
+from typing import Dict, Iterable, List, Tuple
+from noisemodels import *
+from noisecore import *
+from noisesensitivity import get_variants
+
+# Timetable aggregation of single pass results into LAeq and Lden. Each distinct pass type
+# (param, variant) in the timetable is evaluated once per receptor, through the run's
+# ScenarioCache, and its energy reused for every timetabled pass of that type.
+
+# Hours in each period: day 07-19, evening 19-23, night 23-07
+HOURS = {"day": 12, "evening": 4, "night": 8}
+
+# Lden penalties for the evening and night periods
+PENALTY = {"day": 0, "evening": 5, "night": 10}
+
+def pass_types(params: Dict[str, Param], passes: List[Pass]) -> Dict[Tuple[str, str], Param]:
+    """Build the param for each distinct (param, variant) in the timetable."""
+    types = {}
+    for ps in passes:
+        key = (ps.param, ps.variant)
+        if key not in types:
+            q = params[ps.param]
+            if ps.variant:
+                q = copy.deepcopy(q)
+                get_variants([ps.variant])[0](q)
+            types[key] = q
+    return types
+
+def pass_energy(p: Param, impact: Impact) -> float:
+    # Sound exposure of one pass in linear units x seconds. The level at each train position
+    # (Result.spl, summed in Impact.sumspl) lasts for the time taken to travel one sector.
+    return impact.sumspl * p.slen / (p.kph * 1000 / 3600)
+
+def pass_impacts(run, r: Receptor, p: Param, types: Dict[Tuple[str, str], Param], cache) -> Dict[Tuple[str, str], Impact]:
+    """The impacts at a receptor of the pass types of one param, as worker processes send them back."""
+    return {key: cache.runscenario(run, r, q, keep_results=False)[1] for (key, q) in types.items() if key[0] == p.key}
+
+def runtimetable(run, receptors: Iterable[Receptor], params: Dict[str, Param], passes: List[Pass],
+                 cache, index=None, impacts=None) -> List[Exposure]:
+    # impacts holds the pass type impacts already evaluated elsewhere, keyed on
+    # (receptor, (param, variant)), and the rest are evaluated through the cache
+    types = pass_types(params, passes)
+
+    # Passes of each type in each period
+    counts = {key: dict.fromkeys(HOURS, 0.0) for key in types}
+    for ps in passes:
+        for period in HOURS:
+            counts[(ps.param, ps.variant)][period] += getattr(ps, period)
+
+    exposures = []
+    for r in receptors:
+        energy = dict.fromkeys(HOURS, 0.0)
+        maxdb = None
+        # Passes of params outside the influence distance of a receptor, if given one, are left
+        # out, and aren't counted either
+        near = {p.key for p in index.near(r)} if index else params
+        included = [key for key in types if key[0] in near]
+        # A receptor with no timetabled passes in range gets no exposure row, rather than levels
+        # at the floor of dB(0), which averaging them would take as real
+
+        if not any(counts[key][period] for key in included for period in HOURS):
+            continue
+        for key in included:
+            q = types[key]
+            impact = impacts.get((r.key, key)) if impacts else None
+            if impact is None:
+                (_, impact) = cache.runscenario(run, r, q, keep_results=False)
+            e = pass_energy(q, impact)
+            for period in HOURS:
+                energy[period] += counts[key][period] * e
+            if any(counts[key].values()):
+                maxdb = impact.maxdb if maxdb is None else max(maxdb, impact.maxdb)
+
+        laeq = {period: dB(energy[period] / (HOURS[period] * 3600)) for period in HOURS}
+        laeq16h = dB((energy["day"] + energy["evening"]) / (16 * 3600))
+        lden = dB(sum(HOURS[period] * spl(laeq[period] + PENALTY[period]) for period in HOURS) / 24)
+
+        exposures.append(Exposure(
+            run=run,
+            receptor=r.key,
+            impacts=r.impacts,
+            day=sum(counts[key]["day"] for key in included),
+            evening=sum(counts[key]["evening"] for key in included),
+            night=sum(counts[key]["night"] for key in included),
+            laeqday=roundTo(laeq["day"], 2),
+            laeqevening=roundTo(laeq["evening"], 2),
+            laeqnight=roundTo(laeq["night"], 2),
+            laeq16h=roundTo(laeq16h, 2),
+            lden=roundTo(lden, 2),
+            maxdb=maxdb if maxdb is not None else 0.0,
+        ))
+
+    return exposures
@@ -0,0 +1,94 @@
+from typing import Dict
+from noisemodels import *
+from noisetrace import tracer
+from noisestats import stats
+import noisecalc
+import noisekernel
+import noiselod
+
+# Compute backends for the noise model. runscenario only needs getNoise for a train position,
+# or levels for all the positions of a scenario at once, so a backend is anything providing
+# that. The scalar code in noisecalc, ported from noisemap.htm, is the reference that every
+# other backend is verified against (see noiseverify).
+
+backends: Dict[str, type] = {}
+
+def backend(name):
+    # Register a backend class under a name that can be selected per run
+    def register(cls):
+        cls.name = name
+        backends[name] = cls
+        return cls
+    return register
+
+class Backend:
+    name = None
+    # Set for backends that trade accuracy for speed, whose error is reported by run
+    approximate = False
+    # Whether the backend reads the barrier angles tables, rather than the barrier runs
+    angles = True
+    # Set for backends that evaluate the train positions of a scenario together, with levels
+    scenario = False
+    # Largest deviation in dB from the reference that an approximate backend allows itself
+    tolerance = 0.0
+
+    def getNoise(self, p: Param, distx, disty, tpos) -> float:
+        """Noise in dB at (distx, disty) from the reference point with the train at tpos."""
+        raise NotImplementedError
+
+    def levels(self, p: Param, distx, disty, sects) -> list:
+        """Noise in dB at (distx, disty) with the train at the end of each of sects."""
+        return [self.getNoise(p, distx, disty, p.slen * (sect + 1)) for sect in sects]
+
+@backend("reference")
+class ReferenceBackend(Backend):
+
+    def getNoise(self, p: Param, distx, disty, tpos) -> float:
+        return noisecalc.getNoise(p, distx, disty, tpos)
+
+@backend("scalar")
+class ScalarBackend(Backend):
+    # The pure Python kernel in noisekernel, which evaluates the positions of a scenario
+    # together. Traced or counted calls go to the reference code, which has the hooks, and
+    # gives the same results.
+    angles = False
+    scenario = True
+
+    def getNoise(self, p: Param, distx, disty, tpos) -> float:
+        if tracer.active or stats.enabled:
+            return noisecalc.getNoise(p, distx, disty, tpos)
+        return noisekernel.getNoise(p, distx, disty, tpos)
+
+    def levels(self, p: Param, distx, disty, sects) -> list:
+        if stats.enabled:
+            return super().levels(p, distx, disty, sects)
+        return noisekernel.levels(p, distx, disty, sects)
+
+@backend("lod")
+class LodBackend(Backend):
+    # Samples the train positions along a scenario, interpolating between distant ones
+    # (see noiselod). Selected as lod, or lod:RATIO for spans other than half the distance
+    # to the receptor. Single positions, such as the impact's, are evaluated exactly, and so are
+    # traced scenarios (at every position), with counted runs going through the reference code.
+    approximate = True
+    scenario = True
+    angles = False
+
+    def __init__(self, ratio: str = "0.5", tolerance: float = 0.04):
+        self.ratio = float(ratio)
+        self.tolerance = tolerance
+
+    def getNoise(self, p: Param, distx, disty, tpos) -> float:
+        if tracer.active or stats.enabled:
+            return noisecalc.getNoise(p, distx, disty, tpos)
+        return noisekernel.getNoise(p, distx, disty, tpos)
+
+    def levels(self, p: Param, distx, disty, sects) -> list:
+        return noiselod.levels(p, distx, disty, sects, self.ratio, self.tolerance)
+
+def get_backend(name: str = "scalar") -> Backend:
+    # Backends taking an option are named with it after a colon, e.g. lod:0.05
+    (name, _, option) = name.partition(":")
+    if name not in backends:
+        raise ValueError(f"Unknown backend {name}, expected one of {', '.join(backends)}")
+    return backends[name](option) if option else backends[name]()
@@ -0,0 +1,185 @@
+import io
+import os
+import json
+import math
+import time
+import random
+import tempfile
+import tracemalloc
+import contextlib
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Callable, Dict, List
+from noisemodels import *
+from noisecalc import *
+from noisesynth import *
+
+# Benchmarks of the model's hot paths over seeded synthetic inputs. Each benchmark reports
+# throughput in units (calls, or scenario-sectors for the scenario level benchmarks) per
+# second and the peak memory traced while it ran. Results are appended to a JSON lines file
+# so that a run can be compared against the previous one for the same benchmark and scale.
+
+@dataclass
+class BenchResult:
+    name: str
+    scale: str
+    seed: int
+    label: str
+    timestamp: str
+    units: int
+    unit: str
+    seconds: float
+    throughput: float
+    peak: int
+
+def measure(fn: Callable[[], int], memory: bool = True) -> tuple:
+    # Time without tracemalloc, which slows Python down several times over,
+    # then repeat under it for the peak memory
+    start = time.perf_counter()
+    units = fn()
+    seconds = time.perf_counter() - start
+
+    peak = 0
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return (units, seconds, peak)
+
+def workloads(scale: Scale, seed: int) -> Dict[str, tuple]:
+    """Build the benchmark functions for a scale, returning name -> (unit, function)."""
+    (receptors, barriers, sourcesets, params) = synth_inputs(scale, seed)
+    rng = random.Random(seed)
+    calls = scale.sectors * 50
+    p = next(iter(params.values()))
+    b = p.barrier1
+
+    def bench_getAngles():
+        getAngles(b.slen, b.bpos)
+        return len(b.bpos)
+
+    sects = [rng.randrange(scale.sectors) for _ in range(calls)]
+    angles = [rng.uniform(-math.pi / 2, math.pi / 2) for _ in range(calls)]
+
+    def bench_intersect():
+        for (sect, angle) in zip(sects, angles):
+            intersect(b.angles, sect, angle)
+        return calls
+
+    barrier_args = [
+        (rng.uniform(0.5, 6.5), rng.uniform(2, 6), rng.uniform(4, 8), rng.uniform(5, 20), rng.uniform(30, 500),
+         rng.choice("ar"), rng.choice([0, 1]))
+        for _ in range(calls)
+    ]
+
+    def bench_barrier():
+        for args in barrier_args:
+            barrier(*args)
+        return calls
+
+    tsects = math.ceil(p.tlen / p.slen)
+    noise2_args = [
+        (rng.choice([0.0, 3.0, 5.0]), rng.choice([0.0, 4.0]), rng.uniform(4, 8), rng.uniform(4, 8),
+         rng.uniform(30, 500), rng.uniform(-1.5, 1.5), rng.randrange(tsects), rng.choice("ar"),
+         rng.choice([0, 10]), rng.uniform(-5, 5))
+        for _ in range(calls)
+    ]
+
+    def bench_getNoise2():
+        for args in noise2_args:
+            getNoise2(p, *args)
+        return calls
+
+    def bench_getNoise():
+        r = next(iter(receptors.values()))
+        for sect in range(scale.sectors):
+            getNoise(p, r.x - p.refpt, r.y, p.slen * (sect + 1))
+        return scale.sectors
+
+    def bench_getNoise_scalar():
+        import noisekernel
+        r = next(iter(receptors.values()))
+        for sect in range(scale.sectors):
+            noisekernel.getNoise(p, r.x - p.refpt, r.y, p.slen * (sect + 1))
+        return scale.sectors
+
+    def bench_runscenario():
+        import noiserun
+        for r in receptors.values():
+            noiserun.runscenario("bench", r, p)
+        return len(receptors) * scale.sectors
+
+    def bench_run():
+        import noiserun
+        from noisesensitivity import sensitivity_funcs
+        with tempfile.TemporaryDirectory() as folder:
+            paths = write_inputs_csv(folder, "", receptors, barriers, sourcesets, params)
+            with contextlib.redirect_stdout(io.StringIO()):
+                noiserun.run(receptors_csv=paths["Receptors"], barriers_csv=paths["Barriers"],
+                             sources_csv=paths["Sources"], params_csv=paths["Params"], outdir=folder)
+        return len(receptors) * len(params) * (1 + len(sensitivity_funcs)) * scale.sectors
+
+    return {
+        "getAngles": ("sectors", bench_getAngles),
+        "intersect": ("calls", bench_intersect),
+        "barrier": ("calls", bench_barrier),
+        "getNoise2": ("calls", bench_getNoise2),
+        "getNoise": ("scenario-sectors", bench_getNoise),
+        "getNoise.scalar": ("scenario-sectors", bench_getNoise_scalar),
+        "runscenario": ("scenario-sectors", bench_runscenario),
+        "run": ("scenario-sectors", bench_run),
+    }
+
+def load_records(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def bench(scale: str = "small", seed: int = 0, only: List[str] = None, record: str = "benchmarks.jsonl",
+          label: str = "", memory: bool = True) -> List[BenchResult]:
+    """Run the benchmarks for a scale, report them against the last recorded run and record them."""
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale}, expected one of {', '.join(SCALES)}")
+
+    previous = {}
+    for rec in load_records(record) if record else []:
+        previous[(rec["name"], rec["scale"], rec["seed"])] = rec
+
+    results = []
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    for (name, (unit, fn)) in workloads(SCALES[scale], seed).items():
+        if only and name not in only:
+            continue
+
+        (units, seconds, peak) = measure(fn, memory)
+        result = BenchResult(
+            name=name,
+            scale=scale,
+            seed=seed,
+            label=label,
+            timestamp=timestamp,
+            units=units,
+            unit=unit,
+            seconds=round(seconds, 4),
+            throughput=round(units / seconds, 1) if seconds else 0.0,
+            peak=peak,
+        )
+        results.append(result)
+
+        change = ""
+        last = previous.get((name, scale, seed))
+        if last and last["throughput"]:
+            change = f" ({100 * (result.throughput / last['throughput'] - 1):+.1f}% vs {last['label'] or last['timestamp']})"
+        print(f"{name:16} {result.throughput:12.1f} {unit}/s  peak {peak / 1e6:8.1f} MB{change}")
+
+    if record:
+        with open(record, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(asdict(result)) + "\n")
+
+    return results
@@ -0,0 +1,211 @@
+import os
+import sys
+import math
+from dataclasses import fields, is_dataclass
+from typing import Dict, List
+from noisemodels import *
+
+# Memory budget for a run. The inputs and angles tables are loaded first and their footprint
+# measured, then what a receptor costs while its chunk is in flight is estimated from the size
+# of sample output rows and scenario cache entries. That gives the number of worker processes,
+# each of which holds its own copy of the params, and the size of the first chunk. After each
+# chunk the rows and cache actually held are measured and the next chunk is sized from those,
+# shrinking it if the process has grown past the plan.
+
+UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+# Smallest chunk worth running in parallel, below which workers are given up to make room
+MIN_CHUNK = 100
+
+# Rows measured for the average size of a list of them
+SAMPLE = 100
+
+def parse_size(text) -> int:
+    """Bytes in a size such as 2G, 512M or 1.5GB."""
+    if isinstance(text, (int, float)):
+        return int(text)
+    value = text.strip().upper().removesuffix("B").removesuffix("I")
+    unit = value[-1:] if value[-1:] in UNITS else ""
+    try:
+        size = float(value[:len(value) - len(unit)]) * UNITS[unit]
+    except ValueError:
+        raise ValueError(f"Invalid memory size {text}, expected a number of bytes or one like 512M or 2G")
+    if size <= 0:
+        raise ValueError(f"Memory size must be positive, not {text}")
+    return int(size)
+
+def format_size(size: float) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+def rss() -> int:
+    """Resident set size of this process, or its peak where the current size can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def footprint(obj, seen=None) -> int:
+    """Bytes held by an object and everything it refers to, each object counted once."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack += obj.keys()
+            stack += obj.values()
+        elif isinstance(obj, (list, tuple)) and obj and type(obj[0]) is float and type(obj[-1]) is float:
+            # Rows of floats, such as the angles tables, are counted without visiting each one
+            size += len(obj) * sys.getsizeof(0.0)
+        elif isinstance(obj, (list, tuple, set)):
+            stack += obj
+        elif is_dataclass(obj):
+            stack += vars(obj).values()
+    return size
+
+def sampled(rows: list) -> int:
+    # Footprint of a long list from a sample of its rows
+    if len(rows) <= SAMPLE:
+        return footprint(rows)
+    step = len(rows) // SAMPLE
+    return sys.getsizeof(rows) + footprint(rows[::step][:SAMPLE]) * len(rows) // SAMPLE
+
+def sample_row(cls, key: str = ""):
+    # A row of the given dataclass with its own objects for every field, as read rows have
+    values = {}
+    for (i, f) in enumerate(fields(cls)):
+        if f.type in (int, "int"):
+            values[f.name] = 10 ** 6 + i
+        elif f.type in (float, "float"):
+            values[f.name] = i + 0.5
+        else:
+            values[f.name] = f"{key}{i}"
+    return cls(**values)
+
+class MemoryBudget:
+
+    def __init__(self, limit: int, headroom: float = 0.8, max_chunk: int = None):
+        # Only headroom of the limit is planned for, leaving the rest for the allocator
+        # and the rows in flight to and from the workers
+        self.limit = limit
+        self.headroom = headroom
+        self.max_chunk = max_chunk
+        # The interpreter with its modules loaded, which each worker process also needs
+        self.start = rss()
+        self.fixed = 0
+        self.params = 0
+        self.receptor = 0
+        self.estimate = 0
+        self.cached = 0
+        self.scenarios = 1
+        self.workers = 1
+        self.chunk_size = max_chunk or 10000
+        self.sizes = []
+        self.peak = 0
+
+    def available(self) -> float:
+        return self.limit * self.headroom - self.fixed - (self.workers * (self.start + self.params) if self.workers > 1 else 0)
+
+    def measure(self, run: str, params: Dict[str, Param], funcs: list, sectors, pairs: int, count: int) -> None:
+        """Estimate the bytes a receptor holds while its chunk is run, once the inputs are loaded."""
+        from noiserun import scenario_key
+
+        self.fixed = rss()
+        self.params = footprint(list(params.values()))
+
+        per_receptor = pairs / count if count else 0
+        self.scenarios = max(1, math.ceil(per_receptor * (1 + len(funcs))))
+        sects = max((len(p.barrier1.bht) for p in params.values()), default=0)
+        if sectors is not None:
+            sects = min(sects, len(sectors))
+
+        key = "x" * max((len(k) for k in params), default=1)
+        result = footprint(sample_row(Result, key))
+        impact = footprint(sample_row(Impact, key))
+        sresult = footprint(sample_row(SensitivityResult, key))
+        entry = max((footprint(scenario_key(sample_row(Receptor, key), p)) for p in list(params.values())[:10]), default=0)
+
+        # Each pair writes its sector results, an impact and a sensitivity result per variant,
+        # and leaves the base results and an impact per variant in the scenario cache
+        outputs = sects * result + impact + (1 + len(funcs)) * sresult
+        cache = sects * result + (1 + len(funcs)) * (impact + entry)
+        self.cached = per_receptor * cache
+        self.estimate = footprint(sample_row(Receptor, key)) + per_receptor * outputs + self.cached
+        self.receptor = self.estimate
+
+    def plan(self, count: int, workers: int = 1) -> int:
+        """Choose the worker count and first chunk size. Returns the worker count."""
+        self.workers = max(1, workers)
+        size = self.available() // max(self.receptor, 1)
+        while self.workers > 1 and size < min(count, MIN_CHUNK):
+            self.workers -= 1
+            size = self.available() // max(self.receptor, 1)
+        if size < 1:
+            raise ValueError(f"A memory budget of {format_size(self.limit)} is too small, the inputs take "
+                             f"{format_size(self.fixed)} and each receptor about {format_size(self.receptor)}")
+        self.chunk_size = self.size(count)
+        return self.workers
+
+    def size(self, count: int = None) -> int:
+        size = max(1, int(self.available() // max(self.receptor, 1)))
+        for limit in (self.max_chunk, count):
+            if limit:
+                size = min(size, limit)
+        return size
+
+    def chunk(self) -> int:
+        """Size of the next chunk, for iter_receptor_chunks."""
+        self.sizes.append(self.chunk_size)
+        return self.chunk_size
+
+    def cache_size(self) -> int:
+        """Scenarios a cache holds for a chunk, shared between the workers if there are several."""
+        return math.ceil(self.chunk_size * self.scenarios / self.workers)
+
+    def observe(self, receptors: int, rows: List[list], cache) -> None:
+        """Measure what a chunk actually held and size the next one from it."""
+        held = sum(sampled(r) for r in rows)
+        if self.workers > 1:
+            # The workers' caches are out of sight, so their estimate stands
+            held += self.cached * receptors
+        elif cache.scenarios:
+            held += sampled(list(cache.scenarios.items()))
+        self.receptor = max(held / max(receptors, 1), 1)
+
+        # Anything the measurements miss shows up in the size of the process
+        current = rss()
+        self.peak = max(self.peak, current)
+        if current > self.limit * self.headroom and current > self.fixed:
+            self.receptor *= (current - self.fixed) / max(self.limit * self.headroom - self.fixed, 1)
+        self.chunk_size = self.size()
+
+    def report(self) -> dict:
+        return {
+            "limit": self.limit,
+            "start": self.start,
+            "fixed": self.fixed,
+            "params": self.params,
+            "receptor.estimate": round(self.estimate),
+            "receptor.measured": round(self.receptor),
+            "workers": self.workers,
+            "chunks": len(self.sizes),
+            "chunk.min": min(self.sizes, default=0),
+            "chunk.max": max(self.sizes, default=0),
+            "peak": max(self.peak, rss()),
+        }
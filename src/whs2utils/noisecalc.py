@@ -1,14 +1,13 @@
 import math
-import logging
 from noisemodels import *
 from noisecore import *
+from noisetrace import tracer
+from noisestats import stats
 
 EPS = 1e-12
 
 def barrier(hs, hb, hr, dsb, dsr, bt, corr):
 
-    logger = logger = logging.getLogger(__name__)
-
     #Barrier attenuation calculation
     #Parameters: height of source, barrier, receptor; shortest distance source-barrier, source-receptor, barrier type (a or r)
 
@@ -33,8 +32,6 @@ def barrier(hs, hb, hr, dsb, dsr, bt, corr):
         - math.sqrt((hr - hs) ** 2 + dsr ** 2)
     )
 
-    logger.debug(f"path difference {pd}")
-
     # Attenuation calculation
     atten = 0
     if bt == "r":
@@ -57,6 +54,12 @@ def barrier(hs, hb, hr, dsb, dsr, bt, corr):
         else:
             atten = -math.exp(1.63 - 12 * pd)
 
+    if stats.enabled:
+        stats.counts["barrier." + bt] += 1
+
+    if tracer.active:
+        tracer.emit("barrier", hs=hs, hb=hb, hr=hr, dsb=dsb, dsr=dsr, bt=bt, pd=pd, atten=atten)
+
     return atten
 
 def getNoise2(p: Param, bht, bht2, bpos, bpos2, dist, angle, tsect, bt, padj, tadj):
@@ -90,8 +93,13 @@ def getNoise2(p: Param, bht, bht2, bpos, bpos2, dist, angle, tsect, bt, padj, ta
         fact400 = 2
 
     # console.log ('getNoise2: x ' + x + ' y ' + y + ' bht ' + bht + ' bht2 ' + bht2 + ' bpos ' + bpos + ' bpos2 ' + bpos2 + ' dist ' + dist + ' angle ' + angle + ' tsect ' + tsect + ' bt ' + bt + ' padj ' + padj +' tadj ' + tadj);
-    logger = logging.getLogger(__name__)
-    logger.debug(f"getNoise2: {x} y {y} bht {bht} bht2 {bht2} bpos {bpos} bpos2 {bpos2} dist {dist} angle {angle} tsect {tsect} bt {bt} padj {padj} tadj {tadj}")
+    if stats.enabled:
+        stats.counts["getNoise2"] += 1
+        stats.counts["getNoise2.barriers." + ("none" if not bht and not bht2 else "two" if bht and bht2 else "one")] += 1
+
+    if tracer.active:
+        tracer.emit("getNoise2", x=x, y=y, bht=bht, bht2=bht2, bpos=bpos, bpos2=bpos2, dist=dist,
+                    angle=angle, tsect=tsect, bt=bt, padj=padj, tadj=tadj)
 
     # Every sector produces rolling noise (wheels on the track)
     if p.sources["rolling"].sval:
@@ -130,7 +138,8 @@ def getNoise2(p: Param, bht, bht2, bpos, bpos2, dist, angle, tsect, bt, padj, ta
         s["pantowell"] = 0
 
     #if (debug == 2) {console.log ('getNoise2: src '); console.log(src);}
-    logger.debug(f"getNoise2: src {s}")
+    if tracer.active:
+        tracer.emit("src", **s)
 
     for key, sval in s.items():
         
@@ -174,7 +183,8 @@ def getNoise2(p: Param, bht, bht2, bpos, bpos2, dist, angle, tsect, bt, padj, ta
             attnb = -10 * math.log10(working)
 
             #if (debug == 2) {console.log ('getNoise2: attnba ' + attnba + ' attnbb ' + attnbb + ' J ' + J + ' attnb ' + attnb);}
-            logger.debug(f"getNoise2: {attnba} attnbb {attnbb} J {J} attnb {attnb}")
+            if tracer.active:
+                tracer.emit("barriers", attnba=attnba, attnbb=attnbb, J=J, attnb=attnb)
 
         lval = sval + attnd + attna
         if bht > 0 or bht2 > 0:
@@ -183,13 +193,11 @@ def getNoise2(p: Param, bht, bht2, bpos, bpos2, dist, angle, tsect, bt, padj, ta
             lval += attng
 
         #if (debug == 2) {console.log ('getNoise2: key ' + key + ' src ' + src[key] + ' attnd ' + attnd + ' attna ' + attna + ' attng ' + attng + ' attnb ' + attnb);}
-        logger.debug(f"getNoise2: key {key} src {sval} attnd {attnd} attna {attna} attng {attng} attnb {attnb})")
+        if tracer.active:
+            tracer.emit("source", key=key, src=sval, sht=sht, attnd=attnd, attna=attna, attng=attng, attnb=attnb, lamax=lval)
 
         l[key] = lval
 
-    #console.log ('getNoise2: lamax '); console.log(lamax);
-    logger.debug(f"getNoise2: lamax {l}")
-
     if p.v >= 2509:
 
         # 250828 Align South Heath NDR Appendix D:
@@ -218,16 +226,28 @@ def intersect(angles, sect, angle):
     for i in range(len(angle_list)):
         # ⚠️ JS allows out-of-bounds access; Python will raise IndexError if i+1 >= len(angle_list)
         if i + 1 < len(angle_list) and angle_list[i + 1] < angle:
+            if stats.enabled:
+                count_intersect(i + 1)
             return i
 
+    if stats.enabled:
+        count_intersect(len(angle_list))
     return 0
 
+def count_intersect(scanned):
+    stats.counts["intersect.calls"] += 1
+    stats.counts["intersect.scanned"] += scanned
+    stats.maximum("intersect.scanned", scanned)
+
 def getNoise(p: Param, distx, disty, tpos):
     # Return noise at a given distance (horizontal, vertical) and train position (furthest point which may be front or back) 
     # relative to reference point
 
     splev = 0  # cumulative spl
 
+    if stats.enabled:
+        stats.counts["getNoise"] += 1
+
     # Number of sectors that the train spans
     tsects = math.ceil(p.tlen / p.slen)
 
@@ -251,10 +271,6 @@ def getNoise(p: Param, distx, disty, tpos):
         else:
             sectt = sect - tsect
 
-        # if (debug) {console.log('getNoise starting sectt ' + sectt);}
-        logger = logging.getLogger(__name__)
-        logger.debug(f"getNoise starting sectt {sectt}")
-
         distt = (sectt + 0.5) * p.slen
         distxc = distx + distt
         dist = math.sqrt(distxc ** 2 + disty ** 2)
@@ -295,7 +311,10 @@ def getNoise(p: Param, distx, disty, tpos):
         #     console.log ('getNoise: data '); console.log(data);
         # }
 
-        logger.debug(f"distx: {distx}, disty: {disty}, tpos: {tpos}, sect: {sect}, sects: {sects}, tsect0: {tsect0}, tsect1: {tsect1}, tsect: {tsect}, sectt: {sectt}, sectt1: {sectt1}, sectt2: {sectt2}, distxc: {distxc}, dist: {dist}, angle: {angle}, bht: {p.barrier1.bht[sectt]}, bpos: {p.barrier1.bpos[sectt]}, tadj: {tadj}, noise: {noise}")
+        if tracer.active:
+            tracer.emit("getNoise", distx=distx, disty=disty, tpos=tpos, sects=sects, tsect0=tsect0, tsect1=tsect1,
+                        tsect=tsect, sectt=sectt, sectt1=sectt1, sectt2=sectt2, distxc=distxc, dist=dist,
+                        angle=angle, bht=p.barrier1.bht[sectt], bpos=p.barrier1.bpos[sectt], tadj=tadj, noise=noise)
 
         # ⚠️ summing in SPL domain: Python spl() equivalent used
         splev += spl(noise)
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import time
+from dataclasses import asdict
+from typing import Dict, List, Tuple
+from noisemodels import *
+
+# Name of the pseudo variant that holds the base scenario for a (receptor, param) pair
+BASELINE = "_baseline"
+
+def checkpoint_path(run: str, folder: str = "noisedata/checkpoints") -> str:
+    return f"{folder}/{run}.jsonl"
+
+def input_digest(path: str) -> str:
+    """sha1 of the contents of an input file, so that a resume notices it has been edited."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+class Checkpoint:
+    # Append-only JSON lines record of the completed (receptor, param, variant) units of a run.
+    # The first line is a header describing the matrix the run was started with, every following
+    # line is one completed unit. Lines are buffered and written out every `every` units or
+    # `interval` seconds, whichever comes first, so a killed job loses at most that much work.
+
+    def __init__(self, path: str, every: int = 50, interval: float = 60.0):
+        self.path = path
+        self.every = every
+        self.interval = interval
+        self.pending: List[str] = []
+        self.last = time.monotonic()
+        self.file = None
+        self.done = None
+
+    def open(self, header: dict, resume: bool = False) -> "Completed":
+        """Open the checkpoint, returning the completed units keyed on (receptor, param, variant)."""
+        offsets = {}
+        if resume:
+            if not os.path.exists(self.path):
+                raise ValueError(f"No checkpoint found at {self.path}")
+            (saved, offsets) = self._read()
+            if saved != header:
+                changed = sorted(k for k in set(saved or {}) | set(header) if (saved or {}).get(k) != header.get(k))
+                raise ValueError(f"Checkpoint {self.path} was written for a different set of inputs "
+                                 f"(changed: {', '.join(changed)})")
+            self.file = open(self.path, "a", encoding="utf-8")
+        else:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(self.path, "w", encoding="utf-8")
+            self.file.write(json.dumps(header) + "\n")
+            self._sync()
+        self.done = Completed(self.path, offsets)
+        return self.done
+
+    def _read(self):
+        # The header and the offset of the line of each completed unit
+        header = None
+        offsets = {}
+        good = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # A job killed mid-write can leave a partial last line, which is dropped
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if header is None:
+                    header = record
+                else:
+                    offsets[(record["receptor"], record["param"], record["variant"])] = good
+                good += len(line)
+        # Trim anything after the last complete line so that new units append cleanly
+        if good != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+        return (header, offsets)
+
+    def add(self, receptor: str, param: str, variant: str, sresult: SensitivityResult,
+            results: List[Result] = None, impact: Impact = None) -> None:
+        record = {
+            "receptor": receptor,
+            "param": param,
+            "variant": variant,
+            "sresult": asdict(sresult),
+        }
+        if results is not None:
+            record["results"] = [asdict(r) for r in results]
+        if impact is not None:
+            record["impact"] = asdict(impact)
+        self.pending.append(json.dumps(record) + "\n")
+
+        if len(self.pending) >= self.every or time.monotonic() - self.last >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.file.write("".join(self.pending))
+            self.pending = []
+        self._sync()
+
+    def _sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last = time.monotonic()
+
+    def close(self, remove: bool = False) -> None:
+        if self.done:
+            self.done.close()
+        if self.file:
+            self.flush()
+            self.file.close()
+            self.file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+class Completed:
+    # The completed units of a resumed run. Only the offset of each unit's line in the
+    # checkpoint is held, so a run with millions of them done doesn't hold all their results,
+    # and a unit's record is read back from the file when its chunk gets to it.
+
+    def __init__(self, path: str, offsets: Dict[Tuple[str, str, str], int]):
+        self.path = path
+        self.offsets = offsets
+        self.file = None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __contains__(self, key) -> bool:
+        return key in self.offsets
+
+    def get(self, key: Tuple[str, str, str]) -> dict:
+        offset = self.offsets.get(key)
+        if offset is None:
+            return None
+        if self.file is None:
+            self.file = open(self.path, "rb")
+        self.file.seek(offset)
+        return json.loads(self.file.readline())
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def restore_unit(record: dict) -> Tuple[List[Result], Impact, SensitivityResult]:
+    """Rebuild the dataclasses stored for a completed unit."""
+    results = [Result(**r) for r in record.get("results", [])]
+    impact = Impact(**record["impact"]) if "impact" in record else None
+    sresult = SensitivityResult(**record["sresult"])
+    return (results, impact, sresult)
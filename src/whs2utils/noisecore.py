@@ -46,3 +46,62 @@ def getAngles(slen, bpos):
 
     return angles
 
+
+def encodeRuns(bht, bpos):
+    # Run length encoding of a barrier as (start, end, bht, bpos) for each stretch of
+    # sectors with the same height and position, end exclusive
+    runs = []
+    for (k, (h, x)) in enumerate(zip(bht, bpos)):
+        if runs and runs[-1][2] == h and runs[-1][3] == x:
+            runs[-1] = (runs[-1][0], k + 1, h, x)
+        else:
+            runs.append((k, k + 1, h, x))
+    return runs
+
+def angleRuns(runs):
+    # The rows of getAngles described by runs of j (start, end, b) over j = 1 .. n-1, in which
+    # angles[i][j] is atan(((i - j + 0.5) * slen) / b) for b > 0, and for b == 0 is copied
+    # from angles[i][end], the first angle of the next run (or 0 at the end of the row)
+    segs = []
+    prev = None
+    for (start, end, h, x) in runs:
+        for (j0, j1, a, c) in ((start, start + 1, prev, x), (start + 1, end, x, x)):
+            j0 = max(j0, 1)
+            if j0 >= j1:
+                continue
+            b = a if a is not None and a > 0 else c if c > 0 else 0
+            if segs and segs[-1][2] == b and segs[-1][1] == j0:
+                segs[-1] = (segs[-1][0], j1, b)
+            else:
+                segs.append((j0, j1, b))
+        prev = x
+    return segs
+
+def intersectRuns(segs, n, slen, sect, angle):
+    # intersect(getAngles(slen, bpos), sect, angle) from the angleRuns of the barrier, by
+    # binary search within each run rather than a scan of the whole row. The angles
+    # compared are worked out exactly as getAngles does, so the results are the same.
+    atan = math.atan
+    for (k, (j0, j1, b)) in enumerate(segs):
+        if b > 0:
+            # The angles fall along a run, so only a run ending below angle holds the first
+            if atan(((sect - (j1 - 1) + 0.5) * slen) / b) < angle:
+                (lo, hi) = (j0, j1 - 1)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if atan(((sect - mid + 0.5) * slen) / b) < angle:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                return lo - 1
+        else:
+            if k + 1 < len(segs):
+                following = atan(((sect - j1 + 0.5) * slen) / segs[k + 1][2])
+            else:
+                # getAngles copies angles[i][n] before setting it to -pi/2, so 0
+                following = 0
+            if following < angle:
+                return j0 - 1
+    if n >= 1 and -math.pi / 2 < angle:
+        return n - 1
+    return 0
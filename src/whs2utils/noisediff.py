@@ -0,0 +1,261 @@
+import os
+import csv
+import json
+import heapq
+import tempfile
+from dataclasses import dataclass, asdict
+from itertools import zip_longest
+from typing import Iterator, List, Tuple
+from noisecore import *
+
+# Comparison of the outputs of two runs. Each output is streamed from both runs at once and
+# rows are paired up on their key in a single pass, holding only the rows that haven't met
+# their partner yet. Runs of the same inputs write their rows in the same order, so that is
+# a handful at a time, and a receptor or param added or removed between the runs costs the
+# rows it accounts for. Outputs in a different order altogether overflow the limit, and are
+# then sorted on disk in chunks and merged instead. The limit, and the size of the chunks, is
+# the most rows held at once: a row read as a dict takes up to about 2KB.
+
+# Default limit on the rows held in memory, about 200MB of them
+LIMIT = 100000
+
+# Key and compared fields of each output, the first field being the one regressions are ranked on
+OUTPUTS = {
+    "impacts": (("param", "receptor"), ("maxdb", "db", "sumspl")),
+    "results": (("param", "receptor", "sect"), ("db", "spl")),
+    "sresults": (("param", "receptor", "key"), ("db", "spl", "deltadb")),
+}
+
+# Linear levels are compared in dB, floored at 0 dB as in noiseverify
+SPL_FLOOR = 1.0
+
+@dataclass
+class Change:
+    output: str
+    key: str
+    status: str
+    field: str
+    a: float
+    b: float
+    delta: float
+
+@dataclass
+class DiffSummary:
+    output: str
+    rows_a: int
+    rows_b: int
+    matched: int
+    only_a: int
+    only_b: int
+    changed: int
+    max_increase: float
+    max_decrease: float
+    mean_abs: float
+
+class Unordered(Exception):
+    pass
+
+def output_path(run: str, output: str, outdir: str = "noisedata") -> str:
+    """The CSV or JSON lines file of one output of a run, given its id or a path prefix."""
+    prefix = run if os.path.dirname(run) else f"{outdir}/{run}"
+    for ext in ("csv", "jsonl"):
+        if os.path.exists(f"{prefix}_{output}.{ext}"):
+            return f"{prefix}_{output}.{ext}"
+    raise ValueError(f"No {output} output found for run {run}")
+
+def read_rows(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def sorted_rows(rows: Iterator[dict], key, chunk: int = LIMIT) -> Iterator[dict]:
+    # External merge sort on key, holding at most chunk rows in memory
+    files = []
+    try:
+        while True:
+            block = [row for (_, row) in zip(range(chunk), rows)]
+            if not block:
+                break
+            block.sort(key=key)
+            f = tempfile.TemporaryFile("w+", encoding="utf-8")
+            for row in block:
+                f.write(json.dumps(row) + "\n")
+            f.seek(0)
+            files.append(f)
+        yield from heapq.merge(*((json.loads(line) for line in f) for f in files), key=key)
+    finally:
+        for f in files:
+            f.close()
+
+def pair_rows(rows_a: Iterator[dict], rows_b: Iterator[dict], key, limit: int) -> Iterator[tuple]:
+    """Pair the rows of two streams on key, yielding (key, a, b) with None for an unmatched row."""
+    pending_a = {}
+    pending_b = {}
+    for (a, b) in zip_longest(rows_a, rows_b):
+        if a is not None:
+            k = key(a)
+            if k in pending_b:
+                yield (k, a, pending_b.pop(k))
+            else:
+                pending_a[k] = a
+        if b is not None:
+            k = key(b)
+            if k in pending_a:
+                yield (k, pending_a.pop(k), b)
+            else:
+                pending_b[k] = b
+        if len(pending_a) + len(pending_b) > limit:
+            raise Unordered()
+    for (k, a) in pending_a.items():
+        yield (k, a, None)
+    for (k, b) in pending_b.items():
+        yield (k, None, b)
+
+def merge_rows(rows_a: Iterator[dict], rows_b: Iterator[dict], key) -> Iterator[tuple]:
+    """Pair the rows of two streams sorted on key, yielding (key, a, b) with None for an unmatched row."""
+    end = object()
+    a = next(rows_a, end)
+    b = next(rows_b, end)
+    while a is not end or b is not end:
+        ka = key(a) if a is not end else None
+        kb = key(b) if b is not end else None
+        if b is end or (a is not end and ka < kb):
+            yield (ka, a, None)
+            a = next(rows_a, end)
+        elif a is end or kb < ka:
+            yield (kb, None, b)
+            b = next(rows_b, end)
+        else:
+            yield (ka, a, b)
+            a = next(rows_a, end)
+            b = next(rows_b, end)
+
+def change(field: str, a, b) -> float:
+    a = float(a)
+    b = float(b)
+    if a != a and b != b:
+        return 0.0
+    if field.endswith("spl"):
+        return dB(max(b, SPL_FLOOR)) - dB(max(a, SPL_FLOOR))
+    return b - a
+
+def diff_output(run_a: str, run_b: str, output: str, outdir: str = "noisedata", tolerance: float = 0.01,
+                top: int = 20, writer=None, limit: int = LIMIT) -> Tuple[DiffSummary, List[Change]]:
+    """Compare one output of two runs, writing each changed row to writer if given."""
+    (keys, compared) = OUTPUTS[output]
+    key = lambda row: tuple(str(row[k]) for k in keys)
+    path_a = output_path(run_a, output, outdir)
+    path_b = output_path(run_b, output, outdir)
+
+    try:
+        return compare(pair_rows(read_rows(path_a), read_rows(path_b), key, limit),
+                       output, compared, tolerance, top, writer)
+    except Unordered:
+        print(f"{output} rows are in a different order in the two runs, sorting them")
+        if writer:
+            writer.restart(output)
+        return compare(merge_rows(sorted_rows(read_rows(path_a), key, limit), sorted_rows(read_rows(path_b), key, limit), key),
+                       output, compared, tolerance, top, writer)
+
+def compare(pairs, output, compared, tolerance, top, writer) -> Tuple[DiffSummary, List[Change]]:
+    rows_a = rows_b = matched = changed = 0
+    max_increase = max_decrease = 0.0
+    total_abs = 0.0
+    # The largest increases in the ranking field, kept as a heap of the top ones
+    regressions = []
+
+    for (k, a, b) in pairs:
+        label = "/".join(k)
+        rows_a += a is not None
+        rows_b += b is not None
+        if a is None or b is None:
+            if writer:
+                writer.write(Change(output=output, key=label, status="only_b" if a is None else "only_a",
+                                    field="", a=float("nan"), b=float("nan"), delta=float("nan")))
+            continue
+
+        matched += 1
+        deltas = [(field, change(field, a[field], b[field])) for field in compared]
+        (_, primary) = deltas[0]
+        if primary == primary:
+            max_increase = max(max_increase, primary)
+            max_decrease = min(max_decrease, primary)
+            total_abs += abs(primary)
+            if primary > tolerance:
+                item = (primary, label)
+                if len(regressions) < top:
+                    heapq.heappush(regressions, item)
+                elif item > regressions[0]:
+                    heapq.heapreplace(regressions, item)
+
+        # NaN on one side only counts as a change
+        moved = [(field, d) for (field, d) in deltas if abs(d) > tolerance or d != d]
+        if moved:
+            changed += 1
+            if writer:
+                for (field, d) in moved:
+                    writer.write(Change(output=output, key=label, status="changed", field=field,
+                                        a=float(a[field]), b=float(b[field]), delta=roundTo(d, 4)))
+
+    summary = DiffSummary(
+        output=output,
+        rows_a=rows_a,
+        rows_b=rows_b,
+        matched=matched,
+        only_a=rows_a - matched,
+        only_b=rows_b - matched,
+        changed=changed,
+        max_increase=roundTo(max_increase, 4),
+        max_decrease=roundTo(max_decrease, 4),
+        mean_abs=roundTo(total_abs / matched, 6) if matched else 0.0,
+    )
+    worst = [Change(output=output, key=label, status="changed", field=compared[0], a=float("nan"), b=float("nan"),
+                    delta=roundTo(d, 4)) for (d, label) in sorted(regressions, reverse=True)]
+    return (summary, worst)
+
+class ChangeWriter:
+    # CSV of the changed rows, written as they are found. An output that has to be sorted
+    # is compared again from the start, so its rows written so far are dropped first.
+
+    def __init__(self, filename: str):
+        self.file = open(filename, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=list(Change.__dataclass_fields__))
+        self.writer.writeheader()
+        self.marks = {}
+
+    def write(self, change: Change) -> None:
+        if change.output not in self.marks:
+            self.file.flush()
+            self.marks[change.output] = self.file.tell()
+        self.writer.writerow(asdict(change))
+
+    def restart(self, output: str) -> None:
+        if output in self.marks:
+            self.file.flush()
+            self.file.seek(self.marks.pop(output))
+            self.file.truncate()
+
+    def close(self) -> None:
+        self.file.close()
+
+def diff(run_a: str, run_b: str, outdir: str = "noisedata", tolerance: float = 0.01, top: int = 20,
+         output: str = None, outputs=tuple(OUTPUTS), limit: int = LIMIT) -> List[DiffSummary]:
+    writer = ChangeWriter(output) if output else None
+    summaries = []
+    try:
+        for name in outputs:
+            (summary, worst) = diff_output(run_a, run_b, name, outdir, tolerance, top, writer, limit)
+            summaries.append(summary)
+            print(f"{name}: {summary.matched} matched, {summary.only_a} only in {run_a}, {summary.only_b} only in {run_b}, "
+                  f"{summary.changed} changed by more than {tolerance}dB")
+            print(f"  {OUTPUTS[name][1][0]} change: max increase {summary.max_increase}, "
+                  f"max decrease {summary.max_decrease}, mean abs {summary.mean_abs}")
+            for change in worst:
+                print(f"  +{change.delta:.2f}dB {change.key}")
+    finally:
+        if writer:
+            writer.close()
+    return summaries
@@ -1,13 +1,18 @@
 import csv
+import math
+import json
 from noisemodels import *
-from typing import Dict, List
+from array import array
+from typing import Dict, Iterator, List
 
 def parse_float_list(value: str) -> List[float]:
     """Convert a + separated string into a list of floats."""
     return [float(v) for v in value.split("+") if v.strip()]
 
 
-def load_barriers_csv(file_path: str) -> Dict[str, Barrier]:
+def load_barriers_csv(file_path: str, angles: bool = True) -> Dict[str, Barrier]:
+    # The angles tables grow with the square of the number of sectors, so can be
+    # skipped where only the barrier heights and positions are needed
     barriers: Dict[str, Barrier] = {}
     with open(file_path, newline="", encoding="utf-8") as csvfile:
         reader = csv.DictReader(csvfile)
@@ -19,14 +24,13 @@ def load_barriers_csv(file_path: str) -> Dict[str, Barrier]:
             if len(bht) != len(bpos):
                 raise ValueError(f"Barrier {row['key']} has mismatched bht/bpos lengths")
 
-            angles = getAngles(slen, bpos)
-
             barrier = Barrier(
                 key=row["key"],
                 slen=slen,
                 bht=bht,
                 bpos=bpos,
-                angles=angles
+                angles=getAngles(slen, bpos) if angles else [],
+                runs=barrier_runs(bht, bpos)
             )
             barriers[barrier.key] = barrier
     return barriers
@@ -45,6 +49,44 @@ def load_receptors_csv(file_path: str) -> Dict[str, Receptor]:
             receptors[receptor.key] = receptor
     return receptors
 
+def iter_receptor_chunks(file_path: str, size=10000, select=None) -> Iterator[ReceptorChunk]:
+    """Read receptors in chunks of up to size, optionally only the keys for which select(key) is true."""
+    # Only one chunk is held at a time, as arrays of doubles rather than Receptor objects,
+    # so files of millions of receptors can be streamed through a run. size may be a
+    # function, called for the size of each chunk as it is started.
+    next_size = size if callable(size) else lambda: size
+    with open(file_path, newline="", encoding="utf-8") as csvfile:
+        reader = csv.DictReader(csvfile)
+        chunk = ReceptorChunk(keys=[], x=array("d"), y=array("d"), impacts=array("d"))
+        limit = None
+        for row in reader:
+            if select and not select(row["key"]):
+                continue
+            chunk.keys.append(row["key"])
+            chunk.x.append(float(row["x"]))
+            chunk.y.append(float(row["y"]))
+            chunk.impacts.append(float(row["impacts"]))
+            if limit is None:
+                limit = next_size()
+            if len(chunk.keys) >= limit:
+                yield chunk
+                chunk = ReceptorChunk(keys=[], x=array("d"), y=array("d"), impacts=array("d"))
+                limit = None
+        if chunk.keys:
+            yield chunk
+
+def receptor_chunk(receptors: Dict[str, Receptor]) -> ReceptorChunk:
+    """The loaded receptors as a single chunk."""
+    return ReceptorChunk(keys=list(receptors), x=array("d", (r.x for r in receptors.values())),
+                         y=array("d", (r.y for r in receptors.values())),
+                         impacts=array("d", (r.impacts for r in receptors.values())))
+
+def chunk_receptor(chunk: ReceptorChunk, i: int) -> Receptor:
+    return Receptor(key=chunk.keys[i], x=chunk.x[i], y=chunk.y[i], impacts=chunk.impacts[i])
+
+def iter_chunk(chunk: ReceptorChunk) -> Iterator[Receptor]:
+    """The receptors of a chunk one at a time, each made as it is reached."""
+    return (chunk_receptor(chunk, i) for i in range(len(chunk.keys)))
 
 def load_sourcesets_csv(file_path: str) -> Dict[str, Dict[str, Source]]:
     sourcesets = {}
@@ -99,6 +141,34 @@ def load_params_csv(file_path: str, barriers: Dict[str,Barrier], sourcesets: Dic
 
     return params
 
+def load_timetable_csv(file_path: str, params: Dict[str, Param]) -> List[Pass]:
+    # Each row is a number of passes in the day (07-19), evening (19-23) and night (23-07)
+    # of a param, optionally changed by a sensitivity variant (e.g. up_360kph)
+    # Imported here, as the variants bring in the noise model, which validate doesn't need
+    from noisesensitivity import sensitivity_variants
+
+    passes: List[Pass] = []
+    with open(file_path, newline="", encoding="utf-8") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            p = Pass(
+                key=row["key"],
+                param=row["param"],
+                variant=(row.get("variant") or "").strip(),
+                day=float(row["day"] or 0),
+                evening=float(row["evening"] or 0),
+                night=float(row["night"] or 0),
+            )
+
+            if p.param not in params:
+                raise ValueError(f"Timetable pass {p.key} refers to unknown param {p.param}")
+            if p.variant and p.variant not in sensitivity_variants:
+                raise ValueError(f"Timetable pass {p.key} refers to unknown variant {p.variant}")
+
+            passes.append(p)
+
+    return passes
+
 def write_list_to_csv(list, filename: str) -> None:
     """Write a list of dataclass objects to a CSV file."""
     if not list:
@@ -111,4 +181,104 @@ def write_list_to_csv(list, filename: str) -> None:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
         for item in list:
-            writer.writerow(asdict(item))
\ No newline at end of file
+            writer.writerow(asdict(item))
+
+def write_list_to_jsonl(list, filename: str) -> None:
+    """Write a list of dataclass objects to a JSON lines file."""
+    if not list:
+        raise ValueError("List is empty, nothing to write.")
+
+    with open(filename, mode="w", encoding="utf-8") as f:
+        for item in list:
+            f.write(json.dumps(asdict(item)) + "\n")
+
+def write_barriers_csv(barriers: List[Barrier], filename: str) -> None:
+    """Write barriers in the layout read by load_barriers_csv."""
+    with open(filename, mode="w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["key", "slen", "bht", "bpos"])
+        for b in barriers:
+            writer.writerow([b.key, b.slen, "+".join(str(h) for h in b.bht), "+".join(str(x) for x in b.bpos)])
+
+# Output formats for write_list
+FORMATS = ("csv", "jsonl")
+
+class ListWriter:
+    # Writes a list of dataclass objects to filename.fmt a part at a time, for outputs
+    # written as they are produced. The file is created with the first non-empty part.
+
+    def __init__(self, filename: str, fmt: str = "csv"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format {fmt}, expected one of {', '.join(FORMATS)}")
+        self.filename = f"{filename}.{fmt}"
+        self.fmt = fmt
+        self.file = None
+        self.writer = None
+
+    def write(self, list) -> None:
+        if not list:
+            return
+        if self.file is None:
+            self.file = open(self.filename, mode="w", newline="", encoding="utf-8")
+            if self.fmt == "csv":
+                self.writer = csv.DictWriter(self.file, fieldnames=list[0].__dataclass_fields__.keys())
+                self.writer.writeheader()
+        for item in list:
+            if self.fmt == "csv":
+                self.writer.writerow(asdict(item))
+            else:
+                self.file.write(json.dumps(asdict(item)) + "\n")
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+        self.file = None
+
+def write_list(list, filename: str, fmt: str = "csv") -> None:
+    """Write a list of dataclass objects to filename.fmt"""
+    if fmt == "csv":
+        write_list_to_csv(list, f"{filename}.csv")
+    elif fmt == "jsonl":
+        write_list_to_jsonl(list, f"{filename}.jsonl")
+    else:
+        raise ValueError(f"Unknown output format {fmt}, expected one of {', '.join(FORMATS)}")
+
+def validate_inputs(receptors_csv: str, barriers_csv: str, sources_csv: str, params_csv: str) -> List[str]:
+    """Check the input files can be run, returning a list of the problems found."""
+    problems = []
+
+    # Loading checks the columns, numbers, bht/bpos lengths, references and toffset signs
+    try:
+        receptors = load_receptors_csv(receptors_csv)
+        barriers = load_barriers_csv(barriers_csv, angles=False)
+        sourcesets = load_sourcesets_csv(sources_csv)
+        params = load_params_csv(params_csv, barriers, sourcesets)
+    except KeyError as e:
+        return [f"Missing column or unknown reference {e}"]
+    except (ValueError, OSError) as e:
+        return [str(e)]
+
+    for r in receptors.values():
+        if r.y == 0:
+            problems.append(f"Receptor {r.key} is on the track centre line (y = 0)")
+
+    for (name, sources) in sourcesets.items():
+        for t in ("rolling", "aero", "startup", "panto", "pantowell"):
+            if t not in sources:
+                problems.append(f"Sourceset {name} has no {t} source")
+
+    for p in params.values():
+        sectors = len(p.barrier1.bht)
+        if len(p.barrier2.bht) < sectors:
+            problems.append(f"Param {p.key} barrier2 {p.barrier2.key} has fewer sectors than barrier1 {p.barrier1.key}")
+        for b in (p.barrier1, p.barrier2):
+            if b.slen != p.slen:
+                problems.append(f"Param {p.key} slen {p.slen} differs from barrier {b.key} slen {b.slen}")
+        # The impact position is the furthest point of the train from the reference point
+        impact = math.ceil((p.tlen + p.pstart + p.plen) / p.slen)
+        if impact > sectors:
+            problems.append(f"Param {p.key} impact position is beyond the last barrier sector ({impact} > {sectors})")
+        if p.kph <= 0:
+            problems.append(f"Param {p.key} kph must be positive")
+
+    return problems
@@ -0,0 +1,256 @@
+import math
+from noisemodels import *
+from noisecore import *
+
+# Dependency free scalar kernel for getNoise, giving the same results as noisecalc bit for bit.
+# It does the same arithmetic in the same order, but
+#   - the source emission levels, source heights and train constants are worked out once
+#     per scenario instead of once per train sector
+#   - the terms of each track sector, up to its level with and without the aero and
+#     pantograph sources, are worked out once per scenario rather than for every train
+#     position over it, which for a whole scenario is about tlen / slen times fewer
+#   - attnd and attna are worked out once per track sector instead of once per source
+#   - the source levels are held in locals instead of fresh s and l dicts
+#   - log_sum and its generator expressions are replaced by explicit sums
+#   - the intersect scan and barrier attenuation are inlined without the tracing and
+#     counting hooks (the scalar backend hands traced or counted calls to noisecalc)
+#   - barriers made of long stretches are intersected from their runs (Barrier.runs) by a
+#     binary search within each stretch rather than a scan of the per-sector angles row, so
+#     need no angles table, and a barrier with no height anywhere isn't intersected at all
+
+def attenuation(hs, hb, hr, dsb, dsr, bt, corr, sqrt=math.sqrt, exp=math.exp, log10=math.log10):
+    # noisecalc.barrier without the hooks
+    if corr != 0:
+        zk = hs + (hr - hs) * dsb / dsr
+        zl = zk + dsb * (dsr - dsb) / (dsr * 26)
+        hb = (hb - zl) + hs
+
+    pd = (
+        sqrt((hb - hs) ** 2 + dsb ** 2)
+        + sqrt((hb - hr) ** 2 + (dsr - dsb) ** 2)
+        - sqrt((hr - hs) ** 2 + dsr ** 2)
+    )
+
+    if bt == "r":
+        if hb / dsb >= hr / dsr:
+            if pd > 0.01:
+                return -11 * (pd ** 0.262)
+            return -3.3
+        return -exp(1.1958 - 14 * pd)
+
+    if hb / dsb > hr / dsr:
+        expr = 2.5 + 30 * (pd + 0.025)
+        if expr > 0:
+            return -10 * log10(expr)
+        return float("nan")
+    return -exp(1.63 - 12 * pd)
+
+def scan(row, angle):
+    # noisecalc.intersect on one angles row without the hooks
+    for i in range(len(row) - 1):
+        if row[i + 1] < angle:
+            return i
+    return 0
+
+def getNoise(p: Param, distx, disty, tpos) -> float:
+    return scenario(p, distx, disty)(tpos)
+
+def levels(p: Param, distx, disty, sects) -> list:
+    """getNoise for the train at the end of each of sects."""
+    level = scenario(p, distx, disty)
+    return [level(p.slen * (sect + 1)) for sect in sects]
+
+def scenario(p: Param, distx, disty, sqrt=math.sqrt, atan=math.atan, sin=math.sin, cos=math.cos,
+             log10=math.log10, ceil=math.ceil):
+    """getNoise at (distx, disty) as a function of the train position tpos."""
+    # The path from a track sector to the receptor, the barrier sectors it crosses and their
+    # attenuation are the same whichever train sector is over it, so they are worked out once
+    # for all the positions of the train over the track sector, rather than once for each.
+    # The train sector only decides whether the aero and pantograph sources are there, so the
+    # level of each track sector is kept for each of those.
+    slen = p.slen
+    tsects = ceil(p.tlen / slen)
+    south = p.dirn == 's'
+
+    # Train constants
+    fact400 = 1
+    if p.tlen == 400:
+        fact400 = 2
+    kph = p.kph
+    rht = p.rht
+    corr = p.corr
+    toffset = p.toffset
+    railht = p.railht
+    refpt = p.refpt
+    rstart = p.rstart
+    rend = p.rstart + p.rlen
+    pstart = p.pstart
+    pend = p.pstart + p.plen
+    newer = p.v >= 2509
+    panto400 = p.v >= 2511 and p.tlen == 400.0
+
+    # Source emission levels before the porous portal adjustment, as in getNoise2
+    sources = p.sources
+    rolling = sources["rolling"]
+    aero = sources["aero"]
+    startup = sources["startup"]
+    panto = sources["panto"]
+    pantowell = sources["pantowell"]
+    rolling_lev = dB(spl(rolling.sval + 30.0 * log10(kph)) * fact400 / tsects) if rolling.sval else None
+    aero_lev = aero.sval + 70.0 * log10(kph) if aero.sval else None
+    startup_lev = dB(spl(startup.sval) * fact400 / tsects) if startup.sval else None
+    panto_lev = panto.sval + 70 * log10(kph) if panto.sval else None
+    pantowell_lev = pantowell.sval + 70 * log10(kph) if pantowell.sval else None
+    rolling_sht = rolling.sht + railht
+    aero_sht = aero.sht + railht
+    startup_sht = startup.sht + railht
+    panto_sht = panto.sht + railht
+    pantowell_sht = pantowell.sht + railht
+
+    b1 = p.barrier1
+    b2 = p.barrier2
+    bht1s = b1.bht
+    bpos1s = b1.bpos
+    bht2s = b2.bht
+    bpos2s = b2.bpos
+    # Barriers are intersected from their runs unless they are too broken up to gain from it
+    # and have an angles table, or were built without runs
+    segs1 = b1.runs.segs if b1.runs and (not b1.angles or compact(b1.runs, len(bht1s))) else None
+    segs2 = b2.runs.segs if b2.runs and (not b2.angles or compact(b2.runs, len(bht2s))) else None
+    flat1 = b1.runs is not None and not b1.runs.height
+    flat2 = b2.runs is not None and not b2.runs.height
+
+    def path(sectt):
+        # (padj, attnd + attna and the barrier or ground attenuation of each source) for a track sector
+        distt = (sectt + 0.5) * slen
+        distxc = distx + distt
+        dist = sqrt(distxc ** 2 + disty ** 2)
+        angle = atan(distxc / disty)
+
+        bt = 'a'
+        if rstart <= sectt * slen < rend:
+            bt = 'r'
+
+        padj = 0
+        if pstart <= sectt * slen < pend:
+            padj = 10
+
+        tadj = -0.000004 * (distt - refpt) ** 2 + 0.0149 * (distt - refpt)
+
+        # intersect() for each barrier. Where a barrier has no height the sector it's
+        # intersected at makes no difference.
+        if flat1:
+            sectt1 = 0
+        elif segs1 is not None:
+            sectt1 = intersectRuns(segs1, len(bht1s), b1.slen, sectt, angle)
+        else:
+            sectt1 = scan(b1.angles[sectt], angle)
+        if flat2:
+            sectt2 = 0
+        elif segs2 is not None:
+            sectt2 = intersectRuns(segs2, len(bht2s), b2.slen, sectt, angle)
+        else:
+            sectt2 = scan(b2.angles[sectt], angle)
+
+        bht = bht1s[sectt1]
+        bht2 = bht2s[sectt2]
+
+        # getNoise2 from here on
+        x = dist * sin(angle)
+        y = dist * cos(angle) + toffset
+        angle2 = atan(x / y)
+        c = cos(angle2)
+        bpos = (bpos1s[sectt1] + toffset) / c
+        bpos2 = (bpos2s[sectt2] + toffset) / c
+        d = y / c
+
+        attnd = -14.5 * log10(d / 25)
+        attna = -d / 120
+        hr = rht + tadj
+        barriers = bht > 0 or bht2 > 0
+
+        attns = []
+        for sht in (rolling_sht, aero_sht, startup_sht, panto_sht, pantowell_sht):
+            if barriers:
+                if bht and not bht2:
+                    attnb = attenuation(sht, bht, hr, bpos, d, bt, corr)
+                elif bht2 and not bht:
+                    attnb = attenuation(sht, bht2, hr, bpos2, d, bt, corr)
+                else:
+                    attnb1 = attenuation(sht, bht, hr, bpos, d, bt, corr)
+                    attnb2 = attenuation(sht, bht2, hr, bpos2, d, bt, corr)
+                    attnba = min(attnb1, attnb2)
+                    attnbb = max(attnb1, attnb2)
+                    J = (abs(bpos - bpos2) / d) ** 0.25
+                    working = (10 ** (-attnba / 10)) + (10 ** (-attnbb * J / 10)) - 1
+                    working = max(working, EPS)
+                    attnb = -10 * log10(working)
+            else:
+                mph = max(((max(sht, bht) + rht) / 2), 1)
+                attnb = -d / (130 * mph)
+            attns.append(attnb)
+        return (padj, attnd, attna, attns)
+
+    def noise(sectt, with_aero, with_panto):
+        # The spl of the train sector over sectt, with or without the aero and pantograph sources
+        if sectt not in paths:
+            paths[sectt] = path(sectt)
+        (padj, attnd, attna, (a_rolling, a_aero, a_startup, a_panto, a_pantowell)) = paths[sectt]
+
+        s_rolling = rolling_lev - padj if rolling_lev is not None else 0
+        s_aero = aero_lev - padj if with_aero and aero_lev is not None else 0
+        s_startup = startup_lev - padj if startup_lev is not None else 0
+        s_panto = panto_lev - padj if with_panto and panto_lev is not None else 0
+        s_pantowell = pantowell_lev - padj if with_panto and pantowell_lev is not None else 0
+
+        # Added in the same order as getNoise2
+        l_rolling = s_rolling + attnd + attna + a_rolling
+        l_aero = s_aero + attnd + attna + a_aero
+        l_startup = s_startup + attnd + attna + a_startup
+        l_panto = s_panto + attnd + attna + a_panto
+        l_pantowell = s_pantowell + attnd + attna + a_pantowell
+
+        if newer:
+            spl_rolling = 10.0 ** (l_rolling / 10.0)
+            spl_startup = 10.0 ** (l_startup / 10.0)
+            combo1 = dB(spl_rolling + 10.0 ** (l_aero / 10.0) + spl_startup)
+            combo2 = dB(spl_rolling + 10.0 ** (l_panto / 10.0) + 10.0 ** (l_pantowell / 10.0) + spl_startup)
+            level = max(combo1, combo2)
+        else:
+            level = dB(10.0 ** (l_rolling / 10.0) + 10.0 ** (l_startup / 10.0) + 10.0 ** (max(l_aero, l_panto) / 10.0))
+        return 10.0 ** (level / 10.0)
+
+    paths = {}
+    terms = {}
+
+    def level(tpos):
+        sect = ceil(tpos / slen) - 1
+        sects = min(sect + 1, tsects)
+        if south:
+            tsect0 = tsects - sects
+            tsect1 = tsects - 1
+        else:
+            tsect0 = 0
+            tsect1 = sects - 1
+
+        splev = 0
+        for tsect in range(tsect0, tsect1 + 1):
+            if south:
+                sectt = sect + tsect - tsects + 1
+            else:
+                sectt = sect - tsect
+
+            include_panto = (tsect == tsects - 1)
+            if panto400 and not include_panto:
+                if (tsect * slen) >= 200.0 and ((tsect - 1) * slen) < 200.0:
+                    include_panto = True
+
+            key = (sectt, tsect == 0, include_panto)
+            term = terms.get(key)
+            if term is None:
+                term = terms[key] = noise(sectt, tsect == 0, include_panto)
+            splev += term
+
+        return dB(splev)
+
+    return level
@@ -0,0 +1,154 @@
+import math
+from bisect import bisect_right
+from noisemodels import *
+from noisecore import intersectRuns
+from noisestats import stats
+import noisecalc
+import noisekernel
+
+# Level of detail evaluation of a scenario. At full resolution the level is evaluated at every
+# train position along the route, but once the train is far from the receptor the level changes
+# slowly and smoothly from one position to the next. Rather than merging distant sectors into
+# longer equivalent sources, which still leaves an evaluation per position, the positions are
+# sampled: the ends of the route are evaluated, and a span between two evaluated positions is
+# filled in by linear interpolation (in dB) once
+#   - it is no longer than `ratio` of the distance from the receptor to the track the train
+#     covers over the span,
+#   - the whole train is on track of one rail type and portal section and screened by the
+#     same stretch of each barrier at both ends of the span (checked at the front and back of
+#     the train and a 400m train's middle pantograph), so the level has no step in it, and
+#   - the middle and quarter points of the span are within half of `tolerance` dB of the
+#     straight line between its ends.
+# A span whose ends differ in those surroundings is split at the position they change, found
+# from the surroundings alone, and any other span is split in half and tried again, down to
+# single positions, which are all evaluated. Every evaluation is an exact one (from the scalar
+# kernel, or the reference code in counted runs), so with ratio 0 the results are exact.
+#
+# The interpolated levels stay within `tolerance` of the exact ones where the level between
+# the checked points is no more curved than at them, which the surroundings check makes the
+# case short of a kink in the barrier attenuation. On the synthetic inputs (noisesynth) the
+# largest deviation of a Result.db is 0.01, the rounding of the outputs.
+#
+# The number of evaluations grows with the log of the length of each uniform stretch of track,
+# plus about a train's length of positions for each change along it, at which the train
+# straddles the change and all its positions are evaluated. The scalar kernel works out the
+# terms of each track sector once for a whole scenario, which the evaluations here share, so
+# a position it evaluates costs little more than adding those up and leaving positions out
+# saves little. Where barriers change every few hundred metres, as in the synthetic inputs,
+# lod is slower than scalar; along long uninterrupted stretches it is somewhat faster.
+
+def reach(p: Param, distx, disty, first: int, last: int) -> float:
+    # Distance from the receptor to the nearest point of the track covered by the train at
+    # the positions (sectors) from first to last. The train at sect covers the sectors from
+    # sect - tsects + 1 (or 0) to sect, centred at (sectt + 0.5) * slen as in getNoise.
+    tsects = math.ceil(p.tlen / p.slen)
+    lo = distx + (max(first - tsects + 1, 0) + 0.5) * p.slen
+    hi = distx + (last + 0.5) * p.slen
+    dx = 0.0 if lo <= 0.0 <= hi else min(abs(lo), abs(hi))
+    return math.sqrt(dx ** 2 + disty ** 2)
+
+def stretch(b: Barrier, sect: int) -> int:
+    # Index of the run of constant height and position of a barrier holding sect
+    return bisect_right(b.runs.runs, sect, key=lambda run: run[0]) - 1
+
+def ends(p: Param) -> list:
+    # The train sectors with the aero and pantograph sources, counted from the front
+    tsects = math.ceil(p.tlen / p.slen)
+    tsect = [0, tsects - 1]
+    if p.v >= 2511 and p.tlen == 400.0:
+        tsect.append(math.ceil(200.0 / p.slen))
+    return tsect
+
+def section(x, start, length) -> int:
+    # 0 before a section of the track, 1 in it and 2 after it
+    return 0 if x < start else 1 if x < start + length else 2
+
+def surroundings(p: Param, distx, disty, sect: int, tsect: int) -> tuple:
+    # What the term of a train sector depends on other than smoothly with the train at the end
+    # of sect, as in getNoise: where it is relative to the rail and portal sections
+    # and the barrier stretches it is screened by. None when the train sector isn't on the track yet.
+    tsects = math.ceil(p.tlen / p.slen)
+    # The train sectors on the track, from the front, as in getNoise
+    on = min(sect + 1, tsects)
+    (tsect0, tsect1) = (tsects - on, tsects - 1) if p.dirn == 's' else (0, on - 1)
+    if not tsect0 <= tsect <= tsect1:
+        return None
+    sectt = sect + tsect - tsects + 1 if p.dirn == 's' else sect - tsect
+    angle = math.atan((distx + (sectt + 0.5) * p.slen) / disty)
+    # Which side of the rail and portal sections, or in them, rather than in or out, so that
+    # a section shorter than a span isn't missed between its ends
+    return (section(sectt * p.slen, p.rstart, p.rlen), section(sectt * p.slen, p.pstart, p.plen),
+            tuple(stretch(b, intersectRuns(b.runs.segs, len(b.bht), b.slen, sectt, angle))
+                  for b in (p.barrier1, p.barrier2) if b.runs.height))
+
+def levels(p: Param, distx, disty, sects, ratio: float = 0.5, tolerance: float = 0.04) -> list:
+    """getNoise for the train at the end of each of sects (in increasing order), sampling distant positions."""
+    n = len(sects)
+    if n == 0:
+        return []
+
+    # Counted runs evaluate through the reference code, which has the hooks, so the counters
+    # show the evaluations actually made
+    exact = (lambda tpos: noisecalc.getNoise(p, distx, disty, tpos)) if stats.enabled else noisekernel.scenario(p, distx, disty)
+    levels = [None] * n
+    evaluated = 0
+
+    def evaluate(i):
+        nonlocal evaluated
+        if levels[i] is None:
+            levels[i] = exact(p.slen * (sects[i] + 1))
+            evaluated += 1
+        return levels[i]
+
+    def between(a, b, i):
+        return levels[a] + (levels[b] - levels[a]) * (sects[i] - sects[a]) / (sects[b] - sects[a])
+
+    keys = ends(p)
+    seen = {}
+
+    def around(i):
+        if i not in seen:
+            seen[i] = [surroundings(p, distx, disty, sects[i], tsect) for tsect in keys]
+        return seen[i]
+
+    spans = [(0, n - 1)]
+    while spans:
+        (a, b) = spans.pop()
+        evaluate(a)
+        evaluate(b)
+        if b - a < 2:
+            continue
+
+        if around(a) != around(b):
+            # Split at the last position with the same surroundings as a, found from the
+            # surroundings alone, so a change along the track costs two evaluations
+            (lo, hi) = (a, b)
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if around(mid) == around(a):
+                    lo = mid
+                else:
+                    hi = mid
+            spans.append((a, lo))
+            spans.append((hi, b))
+            continue
+
+        m = (a + b) // 2
+        # While the train straddles a change in its surroundings its sectors cross the change
+        # one position at a time, so the level steps and isn't interpolated.
+        # NaN levels fail the comparison, so spans with them are always split
+        if ((sects[b] - sects[a]) * p.slen <= ratio * reach(p, distx, disty, sects[a], sects[b])
+                and all(s == around(a)[0] for s in around(a))
+                and all(abs(evaluate(q) - between(a, b, q)) <= tolerance / 2 for q in (m, (a + m) // 2, (m + b) // 2))):
+            for (lo, hi) in ((a, (a + m) // 2), ((a + m) // 2, m), (m, (m + b) // 2), ((m + b) // 2, b)):
+                for i in range(lo + 1, hi):
+                    levels[i] = between(lo, hi, i)
+        else:
+            spans.append((a, m))
+            spans.append((m, b))
+
+    if stats.enabled:
+        stats.counts["lod.positions"] += n
+        stats.counts["lod.evaluated"] += evaluated
+
+    return levels
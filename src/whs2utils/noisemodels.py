@@ -1,4 +1,5 @@
 import math
+from array import array
 from dataclasses import dataclass, fields, asdict
 from typing import Dict, List
 from noisecore import *
@@ -17,6 +18,24 @@ class Receptor:
     y: float
     impacts: float
 
+@dataclass
+class BarrierRuns:
+    # Run length encoded form of a barrier used by the model in place of the per-sector
+    # lists: the stretches of constant bht and bpos (noisecore.encodeRuns), the angles
+    # table rows as runs (noisecore.angleRuns) and whether it has any height at all
+    runs: List[tuple]
+    segs: List[tuple]
+    height: bool
+
+def barrier_runs(bht: List[float], bpos: List[float]) -> BarrierRuns:
+    runs = encodeRuns(bht, bpos)
+    return BarrierRuns(runs=runs, segs=angleRuns(runs), height=any(run[2] for run in runs))
+
+def compact(runs: BarrierRuns, sectors: int) -> bool:
+    # Whether a barrier's stretches are long enough for intersecting it from its runs to beat
+    # scanning its angles table, which is the case for runs of more than a few sectors
+    return len(runs.segs) * 8 <= sectors
+
 @dataclass
 class Barrier:
     key: str
@@ -24,6 +43,7 @@ class Barrier:
     bht: List[float]
     bpos: List[float]
     angles: List[float]
+    runs: BarrierRuns = None
 
 @dataclass
 class Param:
@@ -46,6 +66,14 @@ class Param:
     barrier2: Barrier
     sources: Dict[str,Source]
 
+@dataclass
+class ReceptorChunk:
+    # A block of receptors as columns, see noiseio.iter_receptor_chunks
+    keys: List[str]
+    x: array
+    y: array
+    impacts: array
+
 @dataclass
 class Impact:
     run: str
@@ -83,4 +111,47 @@ class Result:
     bht2: float
     bpos2: float
     db: float
-    spl: float
\ No newline at end of file
+    spl: float
+
+@dataclass
+class Pass:
+    key: str
+    param: str
+    variant: str
+    day: float
+    evening: float
+    night: float
+
+@dataclass
+class Exposure:
+    run: str
+    receptor: str
+    impacts: float
+    day: float
+    evening: float
+    night: float
+    laeqday: float
+    laeqevening: float
+    laeqnight: float
+    laeq16h: float
+    lden: float
+    maxdb: float
+
+@dataclass
+class DesignCheck:
+    run: str
+    barrier: str
+    param: str
+    receptor: str
+    target: float
+    before: float
+    after: float
+    met: bool
+
+@dataclass
+class Skipped:
+    run: str
+    receptor: str
+    near: int
+    skipped: int
+    params: str
@@ -0,0 +1,265 @@
+import os
+import math
+import heapq
+from dataclasses import replace
+from datetime import datetime
+from typing import Dict, List
+from noisemodels import *
+from noisecore import *
+from noiseio import *
+from noisecalc import getNoise2, intersect
+from noiserun import runscenario
+
+# Barrier design. Searches the heights of one barrier, sector by sector, for the least barrier
+# area (sum of bht * slen) that keeps maxdb at each of a set of receptors at or below a target.
+#
+# The heights don't move the paths from the track to a receptor, only how much each path is
+# attenuated, so the geometry of every (param, receptor, sect, tsect) contribution, and the
+# barrier sectors it crosses, is worked out once. Changing the height of one sector then only
+# recomputes the contributions that cross it and the levels at the train positions they belong
+# to, rather than re-running runscenario.
+
+def contributions(p: Param, distx, disty, tpos):
+    # The terms summed by noisecalc.getNoise for the train at tpos, as
+    # (sectt1, sectt2, dist, angle, tsect, btype, padj, tadj)
+    tsects = math.ceil(p.tlen / p.slen)
+    sect = math.ceil(tpos / p.slen) - 1
+    sects = min(sect + 1, tsects)
+
+    if p.dirn == 's':
+        tsect0 = tsects - sects
+        tsect1 = tsects - 1
+    else:
+        tsect0 = 0
+        tsect1 = sects - 1
+
+    for tsect in range(tsect0, tsect1 + 1):
+        if p.dirn == 's':
+            sectt = sect + tsect - tsects + 1
+        else:
+            sectt = sect - tsect
+
+        distt = (sectt + 0.5) * p.slen
+        distxc = distx + distt
+        dist = math.sqrt(distxc ** 2 + disty ** 2)
+        angle = math.atan(distxc / disty)
+
+        btype = 'a'
+        if p.rstart <= sectt * p.slen < p.rstart + p.rlen:
+            btype = 'r'
+
+        padj = 0
+        if p.pstart <= sectt * p.slen < p.pstart + p.plen:
+            padj = 10
+
+        tadj = -0.000004 * (distt - p.refpt) ** 2 + 0.0149 * (distt - p.refpt)
+
+        yield (intersect(p.barrier1.angles, sectt, angle), intersect(p.barrier2.angles, sectt, angle),
+               dist, angle, tsect, btype, padj, tadj)
+
+class BarrierDesigner:
+
+    def __init__(self, barrier: Barrier, receptors: List[Receptor], params: List[Param], target: float,
+                 step: float = 0.5, max_height: float = 8.0):
+        # The design is made on a copy of the barrier, swapped into copies of the params using it
+        self.barrier = replace(barrier, bht=list(barrier.bht), runs=None)
+        self.params = []
+        for p in params:
+            if barrier.key in (p.barrier1.key, p.barrier2.key):
+                self.params.append(replace(
+                    p,
+                    barrier1=self.barrier if p.barrier1.key == barrier.key else p.barrier1,
+                    barrier2=self.barrier if p.barrier2.key == barrier.key else p.barrier2,
+                ))
+        if not self.params:
+            raise ValueError(f"None of the params use barrier {barrier.key}")
+
+        self.receptors = receptors
+        self.target = target
+        self.step = step
+        self.max_height = max_height
+
+        # Only sectors with a barrier line can be built on
+        self.sectors = [k for (k, bpos) in enumerate(barrier.bpos) if bpos > 0]
+
+        # Contributions, each belonging to one train position (param, receptor, sect)
+        self.terms = []
+        self.noise = []
+        self.members = []
+        self.db = []
+        self.crossing = [[] for _ in barrier.bht]
+        self.positions = [set() for _ in barrier.bht]
+        self.pairs = []
+
+        for p in self.params:
+            for r in receptors:
+                start = len(self.members)
+                for sect in range(len(p.barrier1.bht)):
+                    pos = len(self.members)
+                    members = []
+                    for term in contributions(p, r.x - p.refpt, r.y, p.slen * (sect + 1)):
+                        c = len(self.terms)
+                        self.terms.append((p,) + term)
+                        self.noise.append(self.evaluate(c))
+                        members.append(c)
+                        for (b, k) in ((p.barrier1, term[0]), (p.barrier2, term[1])):
+                            if b is self.barrier:
+                                self.crossing[k].append(c)
+                                self.positions[k].add(pos)
+                    self.members.append(members)
+                    self.db.append(self.level(pos, {}))
+                self.pairs.append((p, r, start, len(self.members)))
+
+        self.excess = 0.0
+        self.over = 0
+        for db in self.db:
+            self.excess += max(0.0, db - target)
+            self.over += db > target
+
+    def evaluate(self, c: int) -> float:
+        (p, k1, k2, dist, angle, tsect, btype, padj, tadj) = self.terms[c]
+        return spl(getNoise2(p, p.barrier1.bht[k1], p.barrier2.bht[k2], p.barrier1.bpos[k1], p.barrier2.bpos[k2],
+                             dist, angle, tsect, btype, padj, tadj))
+
+    def level(self, pos: int, noise: Dict[int, float]) -> float:
+        # Summed in the same order as getNoise so that the levels match runscenario exactly
+        splev = 0
+        for c in self.members[pos]:
+            splev += noise[c] if c in noise else self.noise[c]
+        return roundTo(dB(splev), 2)
+
+    def trial(self, k: int, h: float) -> tuple:
+        """Return the (excess, over) there would be with sector k at height h, leaving the design as it is."""
+        old = self.barrier.bht[k]
+        self.barrier.bht[k] = h
+        noise = {c: self.evaluate(c) for c in self.crossing[k]}
+        self.barrier.bht[k] = old
+
+        excess = self.excess
+        over = self.over
+        for pos in self.positions[k]:
+            db = self.level(pos, noise)
+            excess += max(0.0, db - self.target) - max(0.0, self.db[pos] - self.target)
+            over += (db > self.target) - (self.db[pos] > self.target)
+        return (excess, over)
+
+    def apply(self, k: int, h: float) -> None:
+        self.barrier.bht[k] = h
+        for c in self.crossing[k]:
+            self.noise[c] = self.evaluate(c)
+        for pos in self.positions[k]:
+            db = self.level(pos, {})
+            self.excess += max(0.0, db - self.target) - max(0.0, self.db[pos] - self.target)
+            self.over += (db > self.target) - (self.db[pos] > self.target)
+            self.db[pos] = db
+
+    def gain(self, k: int):
+        # Reduction in the total excess over the target per square metre of barrier added by
+        # raising sector k a step, or None if it is already at the maximum height
+        h = roundTo(self.barrier.bht[k] + self.step, 2)
+        if h > self.max_height:
+            return None
+        (excess, _) = self.trial(k, h)
+        return (self.excess - excess) / (self.step * self.barrier.slen)
+
+    def raise_heights(self) -> int:
+        """Raise the sector giving the most reduction per area until the target is met. Returns the steps taken."""
+        # Gains are kept in a heap and only re-evaluated when they reach the top (lazy greedy)
+        heap = []
+        for k in self.sectors:
+            g = self.gain(k)
+            if g is not None and g > 0:
+                heapq.heappush(heap, (-g, k))
+
+        steps = 0
+        while self.over and heap:
+            (_, k) = heapq.heappop(heap)
+            g = self.gain(k)
+            if g is None or g <= 0:
+                continue
+            if heap and -heap[0][0] > g:
+                heapq.heappush(heap, (-g, k))
+                continue
+            self.apply(k, roundTo(self.barrier.bht[k] + self.step, 2))
+            steps += 1
+            g = self.gain(k)
+            if g is not None and g > 0:
+                heapq.heappush(heap, (-g, k))
+        return steps
+
+    def lower_heights(self) -> int:
+        """Lower sectors, tallest first, wherever the levels allow. Returns the steps taken."""
+        steps = 0
+        lowered = True
+        while lowered:
+            lowered = False
+            for k in sorted(self.sectors, key=lambda k: -self.barrier.bht[k]):
+                h = roundTo(max(0.0, self.barrier.bht[k] - self.step), 2)
+                if h == self.barrier.bht[k]:
+                    continue
+                (excess, over) = self.trial(k, h)
+                # Once the target is met it has to stay met, otherwise don't make things worse
+                if (over == 0) if self.over == 0 else (over <= self.over and excess <= self.excess):
+                    self.apply(k, h)
+                    steps += 1
+                    lowered = True
+        return steps
+
+    def area(self) -> float:
+        return sum(self.barrier.bht) * self.barrier.slen
+
+    def maxdb(self) -> list:
+        """maxdb for each (param, receptor) in the design."""
+        return [max(self.db[start:end]) for (_, _, start, end) in self.pairs]
+
+def optimize(barrier_key: str, target: float, receptors_csv: str, barriers_csv: str, sources_csv: str, params_csv: str,
+             receptor_keys=None, param_keys=None, step: float = 0.5, max_height: float = 8.0,
+             outdir: str = "noisedata", fmt: str = "csv") -> Barrier:
+
+    run = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    receptors = load_receptors_csv(receptors_csv)
+    barriers = load_barriers_csv(barriers_csv)
+    sourcesets = load_sourcesets_csv(sources_csv)
+    params = load_params_csv(params_csv, barriers, sourcesets)
+
+    if barrier_key not in barriers:
+        raise ValueError(f"Unknown barrier {barrier_key}")
+    for key in receptor_keys or []:
+        if key not in receptors:
+            raise ValueError(f"Unknown receptor {key}")
+    for key in param_keys or []:
+        if key not in params:
+            raise ValueError(f"Unknown param {key}")
+
+    designer = BarrierDesigner(
+        barriers[barrier_key],
+        [r for r in receptors.values() if not receptor_keys or r.key in receptor_keys],
+        [p for p in params.values() if not param_keys or p.key in param_keys],
+        target, step=step, max_height=max_height)
+
+    before = designer.maxdb()
+    area = designer.area()
+    print(f"Designing barrier {barrier_key} over {len(designer.sectors)} sectors for {len(designer.receptors)} receptors "
+          f"and {len(designer.params)} params, {len(designer.terms)} contributions")
+    print(f"Starting area {area:.1f}m2, {designer.over} train positions over {target}dB")
+
+    raised = designer.raise_heights()
+    lowered = designer.lower_heights()
+    print(f"Raised {raised} and lowered {lowered} sector steps, area {area:.1f}m2 -> {designer.area():.1f}m2")
+    if designer.over:
+        print(f"Target not met at {designer.over} train positions within the maximum height of {max_height}m")
+
+    # The levels of the final design, from the full model
+    checks = []
+    for ((p, r, _, _), maxdb) in zip(designer.pairs, before):
+        (_, impact) = runscenario(run, r, p)
+        checks.append(DesignCheck(run=run, barrier=barrier_key, param=p.key, receptor=r.key, target=target,
+                                  before=maxdb, after=impact.maxdb, met=impact.maxdb <= target))
+
+    os.makedirs(outdir, exist_ok=True)
+    write_barriers_csv([designer.barrier], f"{outdir}/{run}_barrier_{barrier_key}.csv")
+    write_list(checks, f"{outdir}/{run}_design", fmt)
+    print(f"Wrote {outdir}/{run}_barrier_{barrier_key}.csv")
+
+    return designer.barrier
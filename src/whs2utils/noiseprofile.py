@@ -0,0 +1,216 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+from datetime import datetime
+from typing import Dict
+from noisemodels import *
+from noiseio import *
+from noisecore import getAngles
+from noisebackends import get_backend
+from noiseselect import Selection
+import noiserun
+
+# Repeatable profiles of a run, stage by stage. The stages of noiserun.run are run one after
+# another over the selected part of the matrix, twice: once under cProfile and once under
+# tracemalloc, which would otherwise distort the timings. For each stage this writes
+#   {stage}.pstats            cProfile stats, for pstats, snakeviz, gprof2dot or flameprof
+#   {stage}.collapsed         CPU time as collapsed stacks in microseconds, for flamegraph.pl,
+#                             speedscope or inferno
+#   {stage}.alloc.collapsed   bytes allocated and still held at the end of the stage, as
+#                             collapsed stacks
+#   {stage}.txt               top functions by cumulative time and top allocation sites
+# and a profile.json summary of all of them.
+
+STAGES = ("load", "getAngles", "runscenario", "runsensitivity", "write")
+
+def pipeline(run, folder, receptors_csv, barriers_csv, sources_csv, params_csv, selection, funcs, backend, fmt, stage):
+    # The stages of a run, each inside stage(name)
+    with stage("load"):
+        receptors = selection.select_receptors(load_receptors_csv(receptors_csv))
+        barriers = load_barriers_csv(barriers_csv, angles=False)
+        sourcesets = load_sourcesets_csv(sources_csv)
+        params = selection.select_params(load_params_csv(params_csv, barriers, sourcesets))
+
+    with stage("getAngles"):
+        for b in {id(b): b for p in params.values() for b in (p.barrier1, p.barrier2)}.values():
+            b.angles = getAngles(b.slen, b.bpos)
+
+    cache = noiserun.ScenarioCache(get_backend(backend), sectors=selection.sectors)
+
+    impacts = []
+    results = []
+    with stage("runscenario"):
+        for r in receptors.values():
+            for p in params.values():
+                (unit_results, impact) = cache.runscenario(run, r, p)
+                results += unit_results
+                impacts.append(impact)
+
+    sresults = []
+    with stage("runsensitivity"):
+        units = [(r, p) for r in receptors.values() for p in params.values()]
+        for ((r, p), impact) in zip(units, impacts):
+            for f in funcs:
+                sresults.append(noiserun.runsensitivity(run, r, p, impact.maxdb, impact.sumspl, f, cache))
+
+    with stage("write"):
+        write_list(impacts, f"{folder}/{run}_impacts", fmt)
+        write_list(results, f"{folder}/{run}_results", fmt)
+        if sresults:
+            write_list(sresults, f"{folder}/{run}_sresults", fmt)
+
+    return (len(receptors), len(params))
+
+def label(func: tuple) -> str:
+    (filename, lineno, name) = func
+    if filename == "~":
+        # Built in functions
+        return name.replace(";", ":")
+    return f"{name} ({os.path.basename(filename)}:{lineno})".replace(";", ":")
+
+def collapsed_cpu(stats: pstats.Stats, floor: float = 1e-6) -> Dict[str, int]:
+    """Collapsed stacks in microseconds, built from the cProfile call graph."""
+    # cProfile only records caller -> callee edges, so the time of a function called from
+    # several places is shared between its callers in proportion to the time spent in each
+    # call, as flameprof does. Paths worth less than floor seconds are left out.
+    callees = {}
+    for (func, (cc, nc, tt, ct, callers)) in stats.stats.items():
+        for (caller, edge) in callers.items():
+            callees.setdefault(caller, {})[func] = edge[3]
+
+    stacks = {}
+
+    def walk(func, path, seen, factor):
+        (cc, nc, tt, ct, callers) = stats.stats[func]
+        stack = f"{path};{label(func)}" if path else label(func)
+        if tt * factor >= floor:
+            stacks[stack] = stacks.get(stack, 0) + round(tt * factor * 1e6)
+        for (callee, edge) in callees.get(func, {}).items():
+            total = stats.stats[callee][3]
+            if callee in seen or total <= 0 or edge * factor < floor:
+                continue
+            walk(callee, stack, seen | {callee}, edge * factor / total)
+
+    for (func, (cc, nc, tt, ct, callers)) in stats.stats.items():
+        if not callers:
+            walk(func, "", {func}, 1.0)
+    return stacks
+
+def collapsed_alloc(diffs) -> Dict[str, int]:
+    """Collapsed stacks in bytes from tracemalloc StatisticDiffs grouped by traceback."""
+    stacks = {}
+    for diff in diffs:
+        if diff.size_diff <= 0:
+            continue
+        # Tracebacks are most recent call last, the same order as collapsed stacks
+        stack = ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}".replace(";", ":")
+                         for frame in diff.traceback)
+        stacks[stack] = stacks.get(stack, 0) + diff.size_diff
+    return stacks
+
+def write_collapsed(stacks: Dict[str, int], filename: str) -> None:
+    with open(filename, "w", encoding="utf-8") as f:
+        for (stack, value) in sorted(stacks.items()):
+            if value > 0:
+                f.write(f"{stack} {value}\n")
+
+def profile(receptors_csv: str, barriers_csv: str, sources_csv: str, params_csv: str, selection: Selection = None,
+            variants=None, backend: str = "scalar", outdir: str = "noisedata", fmt: str = "csv",
+            top: int = 25, frames: int = 16) -> dict:
+
+    run = datetime.now().strftime("%Y%m%d%H%M%S")
+    folder = f"{outdir}/profile-{run}"
+    os.makedirs(folder, exist_ok=True)
+
+    selection = selection or Selection()
+    funcs = noiserun.select_funcs(variants, selection)
+    args = (run, folder, receptors_csv, barriers_csv, sources_csv, params_csv, selection, funcs, backend, fmt)
+
+    summary = {name: {} for name in STAGES}
+
+    # CPU pass
+    @contextlib.contextmanager
+    def cpu_stage(name):
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            profiler.dump_stats(f"{folder}/{name}.pstats")
+            stats = pstats.Stats(profiler)
+            write_collapsed(collapsed_cpu(stats), f"{folder}/{name}.collapsed")
+
+            ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            summary[name]["seconds"] = round(seconds, 4)
+            summary[name]["functions"] = [
+                {"function": label(func), "calls": nc, "tottime": round(tt, 6), "cumtime": round(ct, 6)}
+                for (func, (cc, nc, tt, ct, callers)) in ranked[:top]
+            ]
+
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats("cumulative").print_stats(top)
+            summary[name]["text"] = text.getvalue()
+
+    print(f"Profiling CPU time in {folder}")
+    (receptors, params) = pipeline(*args, cpu_stage)
+
+    # Allocation pass
+    @contextlib.contextmanager
+    def alloc_stage(name):
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            (current, peak) = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            write_collapsed(collapsed_alloc(after.compare_to(before, "traceback")), f"{folder}/{name}.alloc.collapsed")
+
+            sites = after.compare_to(before, "lineno")[:top]
+            summary[name]["allocated"] = current - start
+            summary[name]["peak"] = peak - start
+            summary[name]["sites"] = [
+                {"site": f"{site.traceback[0].filename}:{site.traceback[0].lineno}",
+                 "size": site.size_diff, "count": site.count_diff}
+                for site in sites
+            ]
+
+    print(f"Profiling allocations in {folder}")
+    tracemalloc.start(frames)
+    try:
+        pipeline(*args, alloc_stage)
+    finally:
+        tracemalloc.stop()
+
+    for name in STAGES:
+        stage = summary[name]
+        with open(f"{folder}/{name}.txt", "w", encoding="utf-8") as f:
+            f.write(f"Stage {name}: {stage['seconds']}s, {stage['allocated']} bytes held, {stage['peak']} bytes peak\n\n")
+            f.write("Top functions by cumulative time\n")
+            f.write(stage.pop("text"))
+            f.write("\nTop allocation sites by size\n")
+            for site in stage["sites"]:
+                f.write(f"{site['size']:>12} bytes {site['count']:>8} blocks  {site['site']}\n")
+
+    with open(f"{folder}/profile.json", "w", encoding="utf-8") as f:
+        json.dump({"run": run, "receptors": receptors, "params": params, "variants": [f.__name__ for f in funcs],
+                   "backend": backend, "stages": summary}, f, indent=2)
+
+    print(f"{'stage':<16}{'seconds':>10}{'peak MB':>10}  top function")
+    for name in STAGES:
+        stage = summary[name]
+        first = next((fn["function"] for fn in stage["functions"]
+                      if not fn["function"].startswith(("<built-in method", "<method", "pipeline", "cpu_stage"))), "")
+        print(f"{name:<16}{stage['seconds']:>10.3f}{stage['peak'] / 1e6:>10.1f}  {first}")
+
+    return summary
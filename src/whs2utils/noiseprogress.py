@@ -0,0 +1,70 @@
+import sys
+import time
+import threading
+
+class Progress:
+    # Rate limited progress report of completed/total scenarios, scenarios per second and ETA.
+    # On a terminal the line is redrawn in place a few times a second. Anywhere else (CI logs,
+    # batch job output) a new line is written every `interval` seconds instead. Updates can
+    # come from several threads.
+
+    def __init__(self, total: int, label: str = "scenarios", stream=None, interval: float = None):
+        self.total = total
+        self.label = label
+        self.stream = stream or sys.stdout
+        self.tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = interval if interval is not None else (0.25 if self.tty else 10.0)
+        self.done = 0
+        self.computed = 0
+        self.start = time.monotonic()
+        self.last = self.start
+        self.lock = threading.Lock()
+
+    def update(self, n: int = 1, computed: bool = True) -> None:
+        """Record n completed scenarios. Pass computed=False for ones restored from a checkpoint."""
+        with self.lock:
+            self.done += n
+            if computed:
+                self.computed += n
+            now = time.monotonic()
+            if now - self.last >= self.interval:
+                self.last = now
+                self._write(self._line(now))
+
+    def _line(self, now: float) -> str:
+        elapsed = now - self.start
+        rate = self.computed / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done
+        eta = format_seconds(remaining / rate) if rate > 0 else "?"
+        percent = 100 * self.done / self.total if self.total else 100.0
+        return f"{self.done}/{self.total} {self.label} ({percent:.1f}%) {rate:.1f}/s ETA {eta}"
+
+    def _write(self, line: str) -> None:
+        if self.tty:
+            self.stream.write("\r\033[K" + line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def close(self) -> None:
+        """Finish with a one line summary."""
+        with self.lock:
+            elapsed = time.monotonic() - self.start
+            rate = self.computed / elapsed if elapsed > 0 else 0.0
+            line = f"Completed {self.done}/{self.total} {self.label} in {format_seconds(elapsed)} ({rate:.1f}/s)"
+            if self.done != self.computed:
+                line += f", {self.done - self.computed} restored"
+            self._write(line)
+            if self.tty:
+                self.stream.write("\n")
+                self.stream.flush()
+
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    (h, rest) = divmod(seconds, 3600)
+    (m, s) = divmod(rest, 60)
+    if h:
+        return f"{h}h{m:02d}m{s:02d}s"
+    if m:
+        return f"{m}m{s:02d}s"
+    return f"{s}s"
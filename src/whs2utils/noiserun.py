@@ -1,95 +1,438 @@
+import os
 import csv
+import json
 import math
 import copy
-from dataclasses import dataclass, fields, asdict
+from dataclasses import dataclass, fields, asdict, replace
 from typing import Dict, List
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from noisemodels import *
 from noiseio import *
 from noisecalc import *
 from noisesensitivity import *
+from noisecheckpoint import *
+from noisetrace import tracer
+from noisestats import stats
+from noisebackends import get_backend
+from noiseprogress import Progress
+from noiseaggregate import runtimetable, pass_types, pass_impacts
+from noiseselect import Selection
+from noisespatial import SegmentIndex, gaps
+from noisebudget import MemoryBudget, parse_size, format_size
 import logging
 
-def run():
+# Default inputs, as read by the original hard coded run
+INPUTS = "noisedata/WHS2 Noise Analysis 2025 - "
+
+# Scenarios sampled for the error of an approximate backend
+ERROR_SAMPLE = 10
+
+def run(resume=None, trace=None, instrument=False, backend="scalar",
+        receptors_csv=f"{INPUTS}Receptors.csv", barriers_csv=f"{INPUTS}Barriers.csv",
+        sources_csv=f"{INPUTS}Sources.csv", params_csv=f"{INPUTS}Params.csv",
+        outdir="noisedata", fmt="csv", workers=1, variants=None, timetable_csv=None, selection=None,
+        chunk_size=None, influence=None, max_memory=None):
 
     # Generate a unique run ID of 14 characters from the system date time
-    run = datetime.now().strftime("%Y%m%d%H%M%S")
+    # or carry on with the run being resumed, so that the outputs are identical
+    run = resume or datetime.now().strftime("%Y%m%d%H%M%S")
 
+    os.makedirs(f"{outdir}/logs", exist_ok=True)
     logging.basicConfig(
-        filename=f"noisedata/logs/log-{run}.log",
-        filemode="w",
-        level=logging.DEBUG, # logging.INFO
+        filename=f"{outdir}/logs/log-{run}.log",
+        filemode="a" if resume else "w",
+        level=logging.INFO,
         format="%(asctime)s [%(levelname)s] %(message)s",
     )
 
-    # Load the input data
-    print("Loading receptors")
-    receptors = load_receptors_csv("noisedata/WHS2 Noise Analysis 2025 - Receptors.csv")
-    print(f"Loaded {len(receptors)} receptors")
-    print("Loading barriers")
-    barriers = load_barriers_csv("noisedata/WHS2 Noise Analysis 2025 - Barriers.csv")
-    print(f"Loaded {len(barriers)} barriers")
-    print("Loading sourcesets")
-    sourcesets = load_sourcesets_csv("noisedata/WHS2 Noise Analysis 2025 - Sources.csv")
-    print(f"Loaded {len(sourcesets)} sourcesets")
-    print("Loading params")
-    params = load_params_csv("noisedata/WHS2 Noise Analysis 2025 - Params.csv", barriers, sourcesets)
-    print(f"Loaded {len(params)} params")
-    print("Loading sourcesets")
-
-    # Write out a playback of the inputs used in this run
-    # The barriers and sources are included inline as fields of the params
-    write_list_to_csv(list(receptors.values()), f"noisedata/{run}_receptors.csv")
-    write_list_to_csv(list(params.values()), f"noisedata/{run}_params.csv")
-
-    impacts = []
-    results = []
-    sresults = []
-
-    for r in receptors.values():
-        for p in params.values():
-            print(f"Runs for receptor {r.key}, params {p.key}")
-
-            # Base result for this receptor and parameter set
-            (base_results,base_impact) = runscenario(run,r,p)
-            results += base_results
-            impacts.append(base_impact)
-
-            # Now do some analysis on the sensitivity of the results to various
-            # changes in the parameters
-            basedb = base_impact.maxdb
-            basespl = base_impact.sumspl 
-            sresults.append(SensitivityResult(
-                run=run,
-                param=p.key,
-                receptor=r.key,
-                key="_baseline",
-                db=0.0,
-                spl=0.0,
-                impacts=base_impact.impacts,
-                basedb=basedb,
-                basespl=basespl,
-                deltadb = basedb,
-                deltaspl= basespl
-            ))
-
-            for f in sensitivity_funcs:
-                sresults.append(runsensitivity(run,r,p,basedb,basespl,f))
-
-    write_list_to_csv(impacts, f"noisedata/{run}_impacts.csv")
-    write_list_to_csv(results, f"noisedata/{run}_results.csv")
-    write_list_to_csv(sresults, f"noisedata/{run}_sresults.csv")
-
-def runsensitivity(run,r,p,basedb,basespl,modify_param_func) -> SensitivityResult:
+    selection = selection or Selection()
+    funcs = select_funcs(variants, selection)
 
-    key = modify_param_func.__name__
+    # Tracing and the hot path counters only see the main process
+    if workers > 1 and (trace is not None or instrument):
+        print("Tracing and instrumentation need a single worker, running with 1")
+        workers = 1
+
+    # Model tracing replaces the old debug logging. trace is a dict of the filters
+    # accepted by Tracer.configure (receptors, params, variants, sectors)
+    if trace is not None:
+        tracer.configure(f"{outdir}/logs/trace-{run}.jsonl", **trace)
+
+    # Stage timings, and the hot path counters if instrument is set, are written
+    # to {run}_stats.json alongside the outputs
+    stats.reset(enabled=instrument)
+
+    # With a memory budget the receptors are streamed through the run in chunks sized to
+    # stay within it, up to chunk_size if that is given as well
+    budget = MemoryBudget(parse_size(max_memory), max_chunk=chunk_size) if max_memory else None
+    stream = bool(chunk_size or budget)
+    read = chunk_size or 10000
+
+    with stats.stage("load"):
+        # Load the input data. With chunk_size the receptors are streamed through the run a
+        # chunk at a time instead, and only counted here.
+        if stream:
+            print("Counting receptors")
+            count = sum(len(chunk.keys) for chunk in iter_receptor_chunks(receptors_csv, read, selection.receptor))
+            if budget:
+                print(f"Found {count} receptors, to be run in chunks fitting {format_size(budget.limit)}")
+            else:
+                print(f"Found {count} receptors, to be run in chunks of {chunk_size}")
+        else:
+            print("Loading receptors")
+            receptors = load_receptors_csv(receptors_csv)
+            print(f"Loaded {len(receptors)} receptors")
+        print("Loading barriers")
+        barriers = load_barriers_csv(barriers_csv, angles=False)
+        print(f"Loaded {len(barriers)} barriers")
+        print("Loading sourcesets")
+        sourcesets = load_sourcesets_csv(sources_csv)
+        print(f"Loaded {len(sourcesets)} sourcesets")
+        print("Loading params")
+        params = load_params_csv(params_csv, barriers, sourcesets)
+        print(f"Loaded {len(params)} params")
+        passes = None
+        if timetable_csv:
+            # Exposures are built from the sound energy of whole passes, which a selection
+            # of sectors would only have part of
+            if selection.sectors:
+                raise ValueError("A timetable can't be aggregated over a selection of sectors, run it without --sector")
+            print("Loading timetable")
+            passes = load_timetable_csv(timetable_csv, params)
+            print(f"Loaded {len(passes)} timetable passes")
+
+        if selection:
+            if not stream:
+                receptors = selection.select_receptors(receptors)
+            params = selection.select_params(params)
+            if passes:
+                passes = [ps for ps in passes if ps.param in params]
+            print(f"Selected {count if stream else len(receptors)} receptors, {len(params)} params and {len(funcs)} variants")
+
+        # Angles tables are only built for the barriers of the params being run, and only for
+        # the broken up ones where the backend works from the barrier runs. The reference code,
+        # which traced and counted calls go to, always needs them.
+        angles = get_backend(backend).angles or trace is not None or instrument
+        for b in {id(b): b for p in params.values() for b in (p.barrier1, p.barrier2)}.values():
+            if angles or not compact(b.runs, len(b.bht)):
+                b.angles = getAngles(b.slen, b.bpos)
+
+    if not stream:
+        count = len(receptors)
+        loaded = receptors
+
+    def chunks(size=read):
+        # The receptors a chunk at a time, as columns
+        if stream:
+            return iter_receptor_chunks(receptors_csv, size, selection.receptor)
+        return [receptor_chunk(loaded)]
+
+    # With an influence distance each receptor is only run against the params whose
+    # stretch of track comes within that distance of it
+    index = None
+    pairs = count * len(params)
+    if influence:
+        index = SegmentIndex(params, influence)
+        # Each param's position in the input, in which the skipped ones are written as runs
+        param_keys = list(params)
+        position = {key: n for (n, key) in enumerate(param_keys)}
+        pairs = sum(len(index.near(r)) for chunk in chunks() for r in iter_chunk(chunk))
+        print(f"Running {pairs} of {count * len(params)} receptor and param pairs within {influence}m")
+
+    # The footprint of the loaded inputs and of a receptor's rows decide the worker count
+    # and chunk sizes under a memory budget
+    if budget:
+        budget.measure(run, params, funcs, selection.sectors, pairs, count)
+        planned = budget.plan(count, workers)
+        if planned < workers:
+            print(f"Running with {planned} of {workers} workers to fit the memory budget")
+        workers = planned
+        print(f"Inputs take {format_size(budget.fixed)}, each receptor about {format_size(budget.receptor)}, "
+              f"starting with chunks of {budget.chunk_size}")
+
+    with stats.stage("write"):
+        # Write out a playback of the inputs used in this run
+        # The barriers and sources are included inline as fields of the params
+        write_list(list(params.values()), f"{outdir}/{run}_params", fmt)
+
+    # Completed (receptor, param, variant) units are checkpointed as we go so that
+    # an interrupted run can be picked up again with run(resume=run_id)
+    checkpoint = Checkpoint(checkpoint_path(run, f"{outdir}/checkpoints"))
+    header = {
+        "receptors": {"file": receptors_csv, "count": count} if stream else list(receptors.keys()),
+        "params": list(params.keys()),
+        "variants": [f.__name__ for f in funcs],
+        # The contents of the inputs and the backend, so that units computed from edited
+        # inputs or by another (possibly approximate) backend aren't mixed in on resume
+        "inputs": {name: input_digest(path) for (name, path) in (("receptors", receptors_csv), ("barriers", barriers_csv),
+                                                                  ("sources", sources_csv), ("params", params_csv))},
+        "backend": backend,
+    }
+    if selection.sectors:
+        header["sectors"] = selection.sectors
+    if influence:
+        header["influence"] = influence
+    done = checkpoint.open(header, resume=bool(resume))
+    if done:
+        print(f"Resuming run {run} with {len(done)} completed units")
+
+    # Effectively identical scenarios are only evaluated once, using the chosen compute backend.
+    # A streamed run only keeps enough of them for a chunk.
+    maxsize = chunk_size * len(params) * (1 + len(funcs)) if chunk_size else None
+    if budget:
+        maxsize = budget.cache_size()
+    cache = ScenarioCache(get_backend(backend), maxsize=maxsize, sectors=selection.sectors)
+
+    progress = Progress(pairs * (1 + len(funcs)))
+
+    # Each worker process has its own copy of the params and scenario cache, and gets
+    # sent the receptor and any restored units for each (receptor, param) pair. It sends
+    # back the impacts of the timetable's pass types for the pair as well, and its cache
+    # counts, which are added to the main process's.
+    executor = None
+    hits = misses = 0
+
+    # Scenarios the error of an approximate backend is measured on, spread evenly over the
+    # (receptor, param) pairs of every chunk
+    sampled = []
+    stride = max(1, pairs // ERROR_SAMPLE)
+    seen = 0
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=init_worker,
+                                       initargs=(params, [f.__name__ for f in funcs], backend, selection.sectors,
+                                                 budget.cache_size() if budget else None,
+                                                 pass_types(params, passes) if passes else None))
+
+    # The outputs are written a chunk at a time as each is completed
+    writers = {name: ListWriter(f"{outdir}/{run}_{name}", fmt)
+               for name in ("receptors", "impacts", "results", "sresults", "exposures", "skipped")}
+
+    try:
+        for chunk in chunks(budget.chunk if budget else read):
+            # The chunk stays in columns, with the units as (receptor index, param). runscenario
+            # and the backends take one receptor at a time, so a unit's receptor is only made
+            # when the unit is run.
+            units = [(i, p) for (i, r) in enumerate(iter_chunk(chunk)) for p in (index.near(r) if index else params.values())]
+            records = [None] * len(units)
+            timetabled = {}
+            if cache.backend.approximate:
+                sampled += [(chunk_receptor(chunk, i), p) for (i, p) in units[(-seen) % stride::stride][:ERROR_SAMPLE - len(sampled)]]
+                seen += len(units)
+
+            def collect(u, unit_records):
+                (i, p) = units[u]
+                for (variant, sresult, results, impact, computed) in unit_records:
+                    if computed:
+                        checkpoint.add(chunk.keys[i], p.key, variant, sresult, results, impact)
+                    progress.update(computed=computed)
+                records[u] = unit_records
+
+            if executor:
+                with stats.stage("compute"):
+                    futures = {}
+                    for (u, (i, p)) in enumerate(units):
+                        r = chunk_receptor(chunk, i)
+                        restored = {k: v for k in unit_keys(r, p, funcs) if (v := done.get(k))}
+                        futures[executor.submit(rununit_worker, run, r, p.key, restored)] = u
+                    for future in as_completed(futures):
+                        (unit_records, unit_impacts, counts) = future.result()
+                        (i, _) = units[futures[future]]
+                        timetabled.update(((chunk.keys[i], key), impact) for (key, impact) in unit_impacts.items())
+                        hits += counts[0]
+                        misses += counts[1]
+                        collect(futures[future], unit_records)
+            else:
+                for (u, (i, p)) in enumerate(units):
+                    collect(u, rununit(run, chunk_receptor(chunk, i), p, funcs, cache, done))
+
+            impacts = []
+            results = []
+            sresults = []
+            for unit_records in records:
+                for (variant, sresult, unit_results, impact, computed) in unit_records:
+                    if variant == BASELINE:
+                        results += unit_results
+                        impacts.append(impact)
+                    sresults.append(sresult)
+
+            # Daily exposure from the timetable, reusing the scenarios evaluated above where it can
+            exposures = None
+            if passes:
+                with stats.stage("aggregate"):
+                    exposures = runtimetable(run, iter_chunk(chunk), params, passes, cache, index, timetabled)
+
+            # The params left out for each receptor, from the pairs run above
+            skipped = []
+            if index:
+                near = {}
+                for (i, p) in units:
+                    near.setdefault(i, []).append(position[p.key])
+                for (i, key) in enumerate(chunk.keys):
+                    positions = near.get(i, [])
+                    if len(positions) < len(params):
+                        skipped.append(Skipped(run=run, receptor=key, near=len(positions),
+                                               skipped=len(params) - len(positions),
+                                               params=gaps(param_keys, positions)))
+
+            with stats.stage("write"):
+                writers["receptors"].write(list(iter_chunk(chunk)))
+                writers["impacts"].write(impacts)
+                writers["results"].write(results)
+                writers["sresults"].write(sresults)
+                writers["exposures"].write(exposures)
+                writers["skipped"].write(skipped)
+
+            if budget:
+                budget.observe(len(chunk.keys), [impacts, results, sresults, exposures or []], cache)
+                cache.maxsize = budget.cache_size()
+    finally:
+        if executor:
+            executor.shutdown()
+        for writer in writers.values():
+            writer.close()
+
+    checkpoint.flush()
+    progress.close()
+
+    hits += cache.hits
+    misses += cache.misses
+    print(f"Evaluated {misses} distinct scenarios, reused {hits}")
+
+    # An approximate backend's error against the full resolution model, from a sample of the scenarios
+    error = None
+    if sampled:
+        error = approximation_error(run, sampled, cache.backend, selection.sectors)
+    if error:
+        print(f"Error of backend {backend} over {error['scenarios']} sampled scenarios: "
+              f"db max {error['db.max']:.2f} mean {error['db.mean']:.4f}, maxdb max {error['maxdb.max']:.2f}")
+
+    # Outputs of a selective run are tagged with the filter that made them
+    if selection:
+        with open(f"{outdir}/{run}_selection.json", "w", encoding="utf-8") as f:
+            json.dump(selection.describe(), f, indent=2)
+
+    stats.write(f"{outdir}/{run}_stats.json", run=run, receptors=count, params=len(params),
+                variants=len(funcs), workers=workers, scenarios=hits + misses,
+                distinct=misses, reused=hits, resumed=len(done),
+                selection=selection.describe() if selection else None, error=error,
+                influence=influence, pairs=pairs, memory=budget.report() if budget else None)
 
-    print(f"Run sensitivity: {key}")
+    # All outputs are written so the checkpoint is no longer needed
+    checkpoint.close(remove=True)
+    tracer.close()
+
+def approximation_error(run, units, backend, sectors=None) -> dict:
+    # Deviation in dB of an approximate backend from the full resolution model over the
+    # given (receptor, param) units
+    exact = get_backend("scalar")
+    dbs = []
+    maxdbs = []
+    for (r, p) in units:
+        (exact_results, exact_impact) = runscenario(run, r, p, exact, sectors)
+        (results, impact) = runscenario(run, r, p, backend, sectors)
+        dbs += [abs(a.db - b.db) for (a, b) in zip(exact_results, results)]
+        maxdbs.append(abs(exact_impact.maxdb - impact.maxdb))
+    if not dbs:
+        return None
+    return {
+        "scenarios": len(maxdbs),
+        "db.max": max(dbs),
+        "db.mean": sum(dbs) / len(dbs),
+        "maxdb.max": max(maxdbs),
+    }
+
+def select_funcs(variants, selection) -> list:
+    # Sensitivity variants by name, or the default list. Variant patterns in the selection
+    # pick from every defined variant unless the names are given.
+    if variants is not None:
+        funcs = get_variants(variants)
+    elif selection.variants:
+        funcs = list(sensitivity_variants.values())
+    else:
+        funcs = sensitivity_funcs
+    return selection.select_variants(funcs)
+
+def unit_keys(r, p, funcs) -> list:
+    return [(r.key, p.key, BASELINE)] + [(r.key, p.key, f.__name__) for f in funcs]
+
+def rununit(run, r, p, funcs, cache, done) -> list:
+    # Run the base scenario and the sensitivity variants for a receptor and param set,
+    # reusing any units restored from a checkpoint. Returns (variant, sresult, results,
+    # impact, computed) for each, where results and impact are only set for the base.
+
+    unit_records = []
+
+    unit = done.get((r.key, p.key, BASELINE))
+    if unit:
+        (base_results, base_impact, base_sresult) = restore_unit(unit)
+    else:
+        # Base result for this receptor and parameter set
+        tracer.scope(r.key, p.key, BASELINE)
+        with stats.stage("compute"):
+            (base_results,base_impact) = cache.runscenario(run,r,p)
+        base_sresult = SensitivityResult(
+            run=run,
+            param=p.key,
+            receptor=r.key,
+            key=BASELINE,
+            db=0.0,
+            spl=0.0,
+            impacts=base_impact.impacts,
+            basedb=base_impact.maxdb,
+            basespl=base_impact.sumspl,
+            deltadb = base_impact.maxdb,
+            deltaspl= base_impact.sumspl
+        )
+    unit_records.append((BASELINE, base_sresult, base_results, base_impact, not unit))
+
+    # Now do some analysis on the sensitivity of the results to various
+    # changes in the parameters
+    basedb = base_impact.maxdb
+    basespl = base_impact.sumspl 
+
+    for f in funcs:
+        unit = done.get((r.key, p.key, f.__name__))
+        if unit:
+            (_, _, sresult) = restore_unit(unit)
+        else:
+            with stats.stage("sensitivity"):
+                sresult = runsensitivity(run,r,p,basedb,basespl,f,cache)
+        unit_records.append((f.__name__, sresult, None, None, not unit))
+
+    return unit_records
+
+# State of a worker process for run(workers=n)
+worker = {}
+
+def init_worker(params, variants, backend, sectors=None, maxsize=None, types=None):
+    worker["params"] = params
+    worker["funcs"] = get_variants(variants)
+    worker["cache"] = ScenarioCache(get_backend(backend), maxsize=maxsize, sectors=sectors)
+    worker["types"] = types
+
+def rununit_worker(run, r, pkey, done) -> tuple:
+    # Returns the unit records, the pass type impacts and the (hits, misses) of the cache for them
+    cache = worker["cache"]
+    (hits, misses) = (cache.hits, cache.misses)
+    p = worker["params"][pkey]
+    unit_records = rununit(run, r, p, worker["funcs"], cache, done)
+    impacts = pass_impacts(run, r, p, worker["types"], cache) if worker["types"] else {}
+    return (unit_records, impacts, (cache.hits - hits, cache.misses - misses))
+
+def runsensitivity(run,r,p,basedb,basespl,modify_param_func,cache=None) -> SensitivityResult:
+
+    key = modify_param_func.__name__
 
     q = copy.deepcopy(p)
     modify_param_func(q) 
 
-    (results, impact) = runscenario(run,r,q)
+    tracer.scope(r.key, p.key, key)
+
+    if cache is not None:
+        (results, impact) = cache.runscenario(run,r,q,keep_results=False)
+    else:
+        (results, impact) = runscenario(run,r,q)
     sresult = SensitivityResult(
         run=run,
         param=p.key,
@@ -106,14 +449,89 @@ def runsensitivity(run,r,p,basedb,basespl,modify_param_func) -> SensitivityResul
 
     return sresult
 
-def runscenario(run,r,p) -> tuple[list[Result],Impact]:
+# The source types that getNoise2 reads from a source set
+SOURCE_TYPES = ("rolling", "aero", "startup", "panto", "pantowell")
+
+def scenario_key(r, p) -> tuple:
+    # Everything runscenario depends on, leaving out the labels (keys) of the receptor,
+    # param, barriers and source set. The model version is reduced to the thresholds
+    # getNoise2 tests it against, so this must be kept in step with any new ones.
+    if p.v >= 2511:
+        v = 2511
+    elif p.v >= 2509:
+        v = 2509
+    else:
+        v = 0
+
+    return (
+        r.x, r.y,
+        v, p.kph, p.rht, p.tlen, p.slen, p.refpt, p.dirn == "s",
+        p.rstart, p.rlen, p.pstart, p.plen, p.corr != 0, p.railht, p.toffset,
+        tuple(p.barrier1.bht), tuple(p.barrier1.bpos), p.barrier1.slen,
+        tuple(p.barrier2.bht), tuple(p.barrier2.bpos), p.barrier2.slen,
+        tuple((p.sources[t].sval, p.sources[t].sht) for t in SOURCE_TYPES),
+    )
+
+class ScenarioCache:
+    # Memo of runscenario outputs keyed on scenario_key, so identical receptors, params and
+    # sensitivity variants that make no effective change are evaluated once and the
+    # results relabelled for each row that needs them. maxsize bounds the number of
+    # scenarios held, dropping the oldest first, for long lived callers such as noiseserve.
+    # sectors limits every scenario evaluated to those train positions.
+
+    def __init__(self, backend=None, maxsize=None, sectors=None):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.sectors = sectors
+        self.scenarios = {}
+        self.hits = 0
+        self.misses = 0
+
+    def runscenario(self, run, r, p, keep_results=True) -> tuple[list[Result],Impact]:
+        key = scenario_key(r, p)
+        cached = self.scenarios.get(key)
+
+        # Per-sector results are only held on to where the caller needs them.
+        # Traced scenarios are always evaluated so that their records are written.
+        if cached and not tracer.selected and (cached[0] is not None or not keep_results):
+            self.hits += 1
+            (results, impact) = cached
+            results = [replace(res, run=run, param=p.key, receptor=r.key) for res in results or []]
+            impact = replace(impact, run=run, param=p.key, receptor=r.key, impacts=r.impacts)
+            return (results, impact)
+
+        self.misses += 1
+        (results, impact) = runscenario(run, r, p, self.backend, self.sectors)
+        self.scenarios.pop(key, None)
+        self.scenarios[key] = (results if keep_results else None, impact)
+        if self.maxsize and len(self.scenarios) > self.maxsize:
+            del self.scenarios[next(iter(self.scenarios))]
+        return (results, impact)
+
+def runscenario(run,r,p,backend=None,sectors=None) -> tuple[list[Result],Impact]:
 
     results = []
 
+    # The reference noisecalc model unless another compute backend is given
+    noise = backend.getNoise if backend else getNoise
+
     sectorcount = len(p.barrier1.bht)
 
-    # Zero based indexing of sectors
-    for sect in range(sectorcount):
+    # Zero based indexing of sectors, optionally limited to a selection of them
+    sects = range(sectorcount) if sectors is None else [s for s in sectors if s < sectorcount]
+
+    if stats.enabled:
+        stats.counts["runscenario"] += 1
+        # The sectors evaluated, which a selection may limit
+        stats.counts["runscenario.sectors"] += len(sects)
+
+    # Backends that evaluate the train positions together give all their levels up front.
+    # Traced scenarios are evaluated a position at a time, so the trace has every one of them.
+    levels = None
+    if backend is not None and backend.scenario and not tracer.selected:
+        levels = backend.levels(p, r.x - p.refpt, r.y, sects)
+
+    for (i, sect) in enumerate(sects):
 
         # How many seconds does it take for the train to travel from the first sector
         # to this sector - time = length / speed in metres per second
@@ -129,7 +547,8 @@ def runscenario(run,r,p) -> tuple[list[Result],Impact]:
 
         # Calculate the noise in decibels when the train is at this position (the end of the sector)
         # as at the receptor location
-        db = getNoise(p, r.x - p.refpt, r.y, tpos)
+        tracer.sector(sect)
+        db = levels[i] if levels is not None else noise(p, r.x - p.refpt, r.y, tpos)
 
         result = Result(
             run=run,
@@ -155,7 +574,8 @@ def runscenario(run,r,p) -> tuple[list[Result],Impact]:
     # Furthest point of noise source from reference point
     offset = p.tlen + p.pstart + p.plen
 
-    db = getNoise(p, r.x - p.refpt, r.y, offset)
+    tracer.sector(None)
+    db = noise(p, r.x - p.refpt, r.y, offset)
     impact = Impact(
         run=run,
         param=p.key,
@@ -0,0 +1,66 @@
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, List
+
+class Selection:
+    # The part of the run matrix to compute. Receptor, param and sensitivity variant keys are
+    # matched against shell style patterns such as R1* or P?_north: a key is selected when it
+    # matches one of the include patterns, or there are none, and none of the exclude patterns.
+    # sectors limits the train positions evaluated in each scenario, None for all of them.
+
+    def __init__(self, receptors: Iterable[str] = (), exclude_receptors: Iterable[str] = (),
+                 params: Iterable[str] = (), exclude_params: Iterable[str] = (),
+                 variants: Iterable[str] = (), exclude_variants: Iterable[str] = (),
+                 sectors: Iterable[int] = None):
+        self.receptors = list(receptors)
+        self.exclude_receptors = list(exclude_receptors)
+        self.params = list(params)
+        self.exclude_params = list(exclude_params)
+        self.variants = list(variants)
+        self.exclude_variants = list(exclude_variants)
+        self.sectors = sorted(set(sectors)) if sectors else None
+
+    def __bool__(self) -> bool:
+        return any(self.describe().values())
+
+    def describe(self) -> dict:
+        """The filter as recorded with the outputs of a selective run."""
+        return {
+            "receptors": self.receptors,
+            "exclude_receptors": self.exclude_receptors,
+            "params": self.params,
+            "exclude_params": self.exclude_params,
+            "variants": self.variants,
+            "exclude_variants": self.exclude_variants,
+            "sectors": self.sectors,
+        }
+
+    def receptor(self, key: str) -> bool:
+        return matches(key, self.receptors, self.exclude_receptors)
+
+    def param(self, key: str) -> bool:
+        return matches(key, self.params, self.exclude_params)
+
+    def variant(self, key: str) -> bool:
+        return matches(key, self.variants, self.exclude_variants)
+
+    def select_receptors(self, receptors: Dict) -> Dict:
+        return {k: r for (k, r) in receptors.items() if self.receptor(k)}
+
+    def select_params(self, params: Dict) -> Dict:
+        selected = {k: p for (k, p) in params.items() if self.param(k)}
+        if self.sectors:
+            # A param with none of the sectors would have no train positions to evaluate
+            for (k, p) in selected.items():
+                count = len(p.barrier1.bht)
+                if self.sectors[0] >= count:
+                    raise ValueError(f"Param {k} has {count} sectors (0-{count - 1}), "
+                                     f"none of the selected sectors {self.sectors[0]}-{self.sectors[-1]}")
+        return selected
+
+    def select_variants(self, funcs: List) -> List:
+        return [f for f in funcs if self.variant(f.__name__)]
+
+def matches(key: str, include: List[str], exclude: List[str]) -> bool:
+    if include and not any(fnmatchcase(key, pattern) for pattern in include):
+        return False
+    return not any(fnmatchcase(key, pattern) for pattern in exclude)
@@ -5,10 +5,23 @@ from noisemodels import Param
 
 sensitivity_funcs = []
 
+# Every variant defined below by name, whether or not it is in the default sensitivity_funcs
+sensitivity_variants = {}
+
 def sensitivity(func):
     #sensitivity_funcs.append(func)
+    sensitivity_variants[func.__name__] = func
     return func
 
+def get_variants(names):
+    # Look up sensitivity variants by name, where "all" selects every variant
+    if "all" in names:
+        return list(sensitivity_variants.values())
+    unknown = [name for name in names if name not in sensitivity_variants]
+    if unknown:
+        raise ValueError(f"Unknown sensitivity variants: {', '.join(unknown)}")
+    return [sensitivity_variants[name] for name in names]
+
 @sensitivity
 def tlen_200(p):
     p.tlen = 200.0
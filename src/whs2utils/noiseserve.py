@@ -0,0 +1,302 @@
+import copy
+import json
+import math
+import time
+import queue
+import threading
+from dataclasses import fields, asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List
+from noisemodels import *
+from noiseio import *
+from noisesensitivity import get_variants
+from noisebackends import get_backend
+import noiserun
+
+# Long lived query server. The inputs are loaded and the barrier angles built once, and
+# evaluated scenarios are kept in a bounded ScenarioCache, so a query costs at most one
+# runscenario. Requests arriving together are gathered into a batch by a single evaluator
+# thread, which only takes out the duplicates: each distinct scenario in the batch is run once,
+# still as a runscenario of its own.
+#
+# POST /query with a query or a list of queries:
+#   {"param": "P1", "x": 1200.0, "y": -85.0, "overrides": {"kph": 330}, "variant": "up_360kph", "results": false}
+# returns the Impact fields (and the per-sector Results if asked for), as runscenario would.
+# GET /params lists the params, GET /health reports the cache.
+#
+# With a tiles folder, GET /tiles/{layer}/{z}/{x}/{y}.png (or .f32) returns a tile of the noise
+# map of a param, or max over all of them, made on first request (see noisetiles). A tile is
+# made in a thread of its own, and one that isn't ready within tile_timeout seconds is answered
+# with 202 and {"pending": ...}, to be asked for again, so a cold tile doesn't hold up the
+# request (or the client) for the minutes it can take.
+
+# Param fields that can be overridden in a query, which is all but the key, barriers and sources
+OVERRIDES = [f.name for f in fields(Param) if f.name not in ("key", "barrier1", "barrier2", "sources")]
+
+class QueryError(ValueError):
+    pass
+
+class TilePending(Exception):
+    pass
+
+class NoiseService:
+
+    def __init__(self, barriers_csv: str, sources_csv: str, params_csv: str,
+                 backend: str = "scalar", window: float = 0.005, cache_size: int = 10000,
+                 tiles: str = None, levels: int = 6, influence: float = None, direct: bool = False,
+                 tile_timeout: float = 10.0):
+        barriers = load_barriers_csv(barriers_csv)
+        sourcesets = load_sourcesets_csv(sources_csv)
+        self.params = load_params_csv(params_csv, barriers, sourcesets)
+        self.cache = noiserun.ScenarioCache(get_backend(backend), maxsize=cache_size)
+        self.window = window
+        self.backend = backend
+        self.tiles = tiles
+        self.levels = levels
+        self.influence = influence
+        self.direct = direct
+        self.tile_timeout = tile_timeout
+        self.pyramids = {}
+        # Tiles being made, by path, until a request picks them up
+        self.making = {}
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        threading.Thread(target=self.evaluator, daemon=True).start()
+
+    def scenario(self, query: dict) -> tuple:
+        # Turn a query into the (receptor, param) to evaluate
+        if query.get("param") not in self.params:
+            raise QueryError(f"Unknown param {query.get('param')}")
+        p = self.params[query["param"]]
+
+        try:
+            x = float(query["x"])
+            y = float(query["y"])
+        except (KeyError, TypeError, ValueError):
+            raise QueryError("x and y must be given as numbers")
+        # The model takes the angle to the track from y, so the receptor can't be on it
+        if not (math.isfinite(x) and math.isfinite(y)) or y == 0.0:
+            raise QueryError("x and y must be finite, with y off the track (not 0)")
+        r = Receptor(key=str(query.get("key", "query")), x=x, y=y, impacts=float(query.get("impacts", 0.0)))
+
+        overrides = query.get("overrides") or {}
+        variant = query.get("variant")
+        if overrides or variant:
+            p = copy.copy(p)
+            for (name, value) in overrides.items():
+                if name not in OVERRIDES:
+                    raise QueryError(f"Param field {name} can't be overridden")
+                try:
+                    setattr(p, name, type(getattr(p, name))(value))
+                except (TypeError, ValueError):
+                    raise QueryError(f"Bad value {value!r} for param field {name}")
+            # As checked when the params are loaded, along with the values the model divides by
+            if p.dirn not in ("n", "s"):
+                raise QueryError(f"dirn must be n or s, not {p.dirn!r}")
+            if (p.dirn == "s" and p.toffset > 0.0) or (p.dirn == "n" and p.toffset < 0.0):
+                raise QueryError("toffset must be negative (or 0) for southbound or positive for northbound")
+            if not p.slen > 0.0:
+                raise QueryError("slen must be positive")
+            if variant:
+                # Variants can change the sources and barriers, which are shared with the loaded params
+                p = copy.deepcopy(p)
+                get_variants([variant])[0](p)
+        return (r, p)
+
+    def query(self, queries: List[dict]) -> List[dict]:
+        """Answer a list of queries, waiting for the evaluator to get to them."""
+        pending = []
+        for query in queries:
+            (r, p) = self.scenario(query)
+            item = {"r": r, "p": p, "results": bool(query.get("results")), "done": threading.Event()}
+            self.queue.put(item)
+            pending.append(item)
+
+        answers = []
+        for item in pending:
+            item["done"].wait()
+            if "error" in item:
+                raise item["error"]
+            answers.append(item["answer"])
+        return answers
+
+    def evaluator(self):
+        while True:
+            # Gather whatever arrives within the batch window of the first query, so that
+            # steady traffic can't hold a batch open
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            try:
+                while (left := deadline - time.monotonic()) > 0:
+                    batch.append(self.queue.get(timeout=left))
+            except queue.Empty:
+                pass
+
+            self.batches += 1
+            self.queries += len(batch)
+
+            # Evaluate the distinct scenarios in the batch once, including the per-sector
+            # results if any query for that scenario wants them
+            scenarios = {}
+            for item in batch:
+                key = noiserun.scenario_key(item["r"], item["p"])
+                scenarios.setdefault(key, []).append(item)
+
+            for items in scenarios.values():
+                keep = any(item["results"] for item in items)
+                for item in items:
+                    try:
+                        (results, impact) = self.cache.runscenario("serve", item["r"], item["p"], keep_results=keep)
+                        answer = asdict(impact)
+                        if item["results"]:
+                            answer["results"] = [asdict(res) for res in results]
+                        item["answer"] = answer
+                    except Exception as e:
+                        item["error"] = e
+                    item["done"].set()
+
+    def tile(self, path: str) -> tuple:
+        """The (content type, bytes) of a tile given its path under /tiles/."""
+        import noisetiles
+
+        if not self.tiles:
+            raise QueryError("Tiles are not being served")
+        try:
+            (layer, z, x, name) = path.split("/")
+            (y, ext) = name.split(".")
+            (z, x, y) = (int(z), int(x), int(y))
+        except ValueError:
+            raise QueryError(f"Tile paths are layer/z/x/y.png or .f32, not {path}")
+        if ext not in ("png", "f32"):
+            raise QueryError(f"Unknown tile format {ext}")
+
+        with self.lock:
+            if layer not in self.pyramids:
+                if layer != "max" and layer not in self.params:
+                    raise QueryError(f"Unknown layer {layer}")
+                self.pyramids[layer] = noisetiles.TilePyramid(self.params, f"{self.tiles}/{layer}", layer=layer,
+                                                              levels=self.levels, backend=self.backend,
+                                                              influence=self.influence, direct=self.direct)
+            pyramid = self.pyramids[layer]
+        try:
+            pyramid.check(z, x, y)
+        except ValueError as e:
+            raise QueryError(str(e))
+
+        # Requests for a tile while it is being made wait on the same item
+        with self.lock:
+            item = self.making.get(path)
+            if item is None:
+                item = self.making[path] = {"done": threading.Event()}
+                threading.Thread(target=self.make_tile, args=(item, pyramid, z, x, y, ext), daemon=True).start()
+        if not item["done"].wait(self.tile_timeout):
+            raise TilePending(f"Tile {path} is being made, ask again shortly")
+        with self.lock:
+            if self.making.get(path) is item:
+                del self.making[path]
+
+        if "error" in item:
+            raise item["error"]
+        return item["data"]
+
+    def make_tile(self, item, pyramid, z, x, y, ext):
+        try:
+            if ext == "png":
+                item["data"] = ("image/png", pyramid.png(z, x, y))
+            else:
+                item["data"] = ("application/octet-stream", pyramid.tile(z, x, y).tobytes())
+            pyramid.flush()
+        except Exception as e:
+            item["error"] = e
+        item["done"].set()
+
+    def health(self) -> dict:
+        return {
+            "params": len(self.params),
+            "cached": len(self.cache.scenarios),
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "batches": self.batches,
+            "queries": self.queries,
+        }
+
+def finite(body):
+    # NaN and infinite levels as null, which JSON has no other way to write
+    if isinstance(body, float) and not math.isfinite(body):
+        return None
+    if isinstance(body, dict):
+        return {k: finite(v) for (k, v) in body.items()}
+    if isinstance(body, list):
+        return [finite(v) for v in body]
+    return body
+
+def make_handler(service: NoiseService):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def reply(self, status: int, body, headers=None) -> None:
+            data = json.dumps(finite(body), allow_nan=False).encode("utf-8")
+            self.send_response(status)
+            for (name, value) in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send(self, content_type: str, data: bytes) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/tiles/"):
+                try:
+                    self.send(*service.tile(self.path[len("/tiles/"):]))
+                except TilePending as e:
+                    self.reply(202, {"pending": str(e)}, {"Retry-After": str(max(1, math.ceil(service.tile_timeout)))})
+                except QueryError as e:
+                    self.reply(404, {"error": str(e)})
+                except Exception as e:
+                    self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+            elif self.path == "/health":
+                self.reply(200, service.health())
+            elif self.path == "/params":
+                self.reply(200, {k: {f: getattr(p, f) for f in OVERRIDES} for (k, p) in service.params.items()})
+            else:
+                self.reply(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/query":
+                self.reply(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if isinstance(body, list):
+                    self.reply(200, service.query(body))
+                else:
+                    self.reply(200, service.query([body])[0])
+            except (QueryError, ValueError) as e:
+                self.reply(400, {"error": str(e)})
+            except Exception as e:
+                self.reply(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, format, *args):
+            # Keep the console quiet for clients that query on every click
+            pass
+
+    return Handler
+
+def serve(service: NoiseService, host: str = "127.0.0.1", port: int = 8765) -> None:
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Serving {len(service.params)} params on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
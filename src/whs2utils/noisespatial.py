@@ -0,0 +1,53 @@
+import math
+from typing import Dict, List, Tuple
+from noisemodels import *
+
+# Spatial index of the route segments modelled by the params. Sector s of a param is at
+# x = refpt - (s + 0.5) * slen (see getNoise), so a param covers the chainage from
+# refpt - sectors * slen to refpt along the track. The index buckets the segments along x in
+# buckets as wide as the influence distance, each segment going in every bucket its extent
+# comes within the distance of, so the segments that can affect a receptor are the ones in
+# its bucket that pass an exact distance check. The distance is to the track the param's
+# source runs on, toffset from the receptor's side of the centre line as in getNoise2.
+
+def extent(p: Param) -> Tuple[float, float]:
+    return (p.refpt - len(p.barrier1.bht) * p.slen, p.refpt)
+
+def distance(p: Param, r: Receptor) -> float:
+    """Distance from a receptor to the nearest point of the track a param covers."""
+    (start, end) = extent(p)
+    dx = max(start - r.x, 0.0, r.x - end)
+    dy = abs(r.y) + p.toffset
+    return math.sqrt(dx ** 2 + dy ** 2)
+
+class SegmentIndex:
+
+    def __init__(self, params: Dict[str, Param], influence: float):
+        if influence <= 0:
+            raise ValueError(f"Influence distance must be positive, not {influence}")
+        self.influence = influence
+        self.params = list(params.values())
+        self.buckets: Dict[int, List[int]] = {}
+        for (i, p) in enumerate(self.params):
+            (start, end) = extent(p)
+            for b in range(self.bucket(start - influence), self.bucket(end + influence) + 1):
+                self.buckets.setdefault(b, []).append(i)
+
+    def bucket(self, x: float) -> int:
+        return math.floor(x / self.influence)
+
+    def near(self, r: Receptor) -> List[Param]:
+        """The params within the influence distance of a receptor, in input order."""
+        return [self.params[i] for i in self.buckets.get(self.bucket(r.x), [])
+                if distance(self.params[i], r) <= self.influence]
+
+def gaps(keys: List[str], near: List[int]) -> str:
+    """The keys other than those at the (increasing) positions near, as + separated runs of
+    consecutive keys written first..last, so a receptor's skipped params cost no more than its near ones."""
+    runs = []
+    start = 0
+    for i in near + [len(keys)]:
+        if i > start:
+            runs.append(keys[start] if i - start == 1 else f"{keys[start]}..{keys[i - 1]}")
+        start = i + 1
+    return "+".join(runs)
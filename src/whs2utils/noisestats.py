@@ -0,0 +1,56 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+class Stats:
+    # Performance counters for the model's hot paths and timings for the stages of a run.
+    # Like the tracer, the model functions only test `stats.enabled` before counting so
+    # there is nothing to pay when it is off.
+
+    def __init__(self):
+        self.enabled = False
+        self.counts = Counter()
+        self.maxima = {}
+        self.stages = {}
+        self.started = None
+
+    def reset(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.counts = Counter()
+        self.maxima = {}
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def maximum(self, name: str, value) -> None:
+        if value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    @contextmanager
+    def stage(self, name: str):
+        """Add the time spent in the with block to the named stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+            stage["seconds"] += time.perf_counter() - start
+            stage["count"] += 1
+
+    def summary(self, **extra) -> dict:
+        summary = dict(extra)
+        summary["elapsed"] = time.perf_counter() - self.started if self.started else 0.0
+        summary["stages"] = self.stages
+        summary["counts"] = dict(sorted(self.counts.items()))
+        summary["maxima"] = self.maxima
+
+        calls = self.counts.get("intersect.calls", 0)
+        if calls:
+            summary["intersect.mean_scan"] = self.counts["intersect.scanned"] / calls
+        return summary
+
+    def write(self, filename: str, **extra) -> None:
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.summary(**extra), f, indent=2)
+
+stats = Stats()
@@ -0,0 +1,153 @@
+import os
+import csv
+import math
+import random
+from dataclasses import dataclass
+from typing import Dict, Tuple
+from noisemodels import *
+
+# Seeded generator of synthetic model inputs, so that benchmarks and comparisons can be
+# reproduced without the private noisedata/ folder
+
+@dataclass
+class Scale:
+    name: str
+    sectors: int
+    receptors: int
+    params: int
+    slen: float = 12.5
+    gaps: float = 0.2
+
+SCALES = {
+    "small": Scale("small", sectors=120, receptors=4, params=2),
+    "medium": Scale("medium", sectors=600, receptors=12, params=4),
+    # 25km of track. The per-sector angles tables grow with the square of the sector count.
+    "corridor": Scale("corridor", sectors=2000, receptors=4, params=2),
+}
+
+SOURCE_TYPES = ("rolling", "aero", "startup", "panto", "pantowell")
+
+# The model adds 30 log10(kph) to the rolling source and 70 log10(kph) to the aero and
+# pantograph sources, so their source values are drawn as a level in dB at 25m (where the
+# distance attenuation is zero) for a whole train at this speed, less the speed term
+REFERENCE_KPH = 300.0
+SPEED_TERMS = {"rolling": 30.0, "aero": 70.0, "startup": 0.0, "panto": 70.0, "pantowell": 70.0}
+
+def synth_barrier(key: str, sectors: int, slen: float, rng: random.Random, gaps: float = 0.2) -> Barrier:
+    # Barriers come in runs of constant height and position, with a fraction of gaps
+    # (zero bht and bpos) between them, like the real barrier files
+    bht = []
+    bpos = []
+    while len(bht) < sectors:
+        runlen = rng.randint(4, 40)
+        if rng.random() < gaps:
+            (ht, pos) = (0.0, 0.0)
+        else:
+            (ht, pos) = (float(rng.choice([2, 3, 3, 4, 5, 6])), float(rng.choice([4, 5, 5, 6, 8])))
+        bht += [ht] * runlen
+        bpos += [pos] * runlen
+    bht = bht[:sectors]
+    bpos = bpos[:sectors]
+    return Barrier(key=key, slen=slen, bht=bht, bpos=bpos, angles=getAngles(slen, bpos), runs=barrier_runs(bht, bpos))
+
+def synth_sourceset(name: str, rng: random.Random) -> Dict[str, Source]:
+    levels = {
+        "rolling": rng.uniform(88, 94),
+        "aero": rng.choice([0.0, rng.uniform(80, 88)]),
+        "startup": rng.uniform(68, 74),
+        "panto": rng.uniform(76, 84),
+        "pantowell": rng.choice([0.0, rng.uniform(70, 78)]),
+    }
+    svals = {t: level - SPEED_TERMS[t] * math.log10(REFERENCE_KPH) if level else 0.0 for (t, level) in levels.items()}
+    shts = {"rolling": 0.5, "aero": 2.0, "startup": 1.0, "panto": 5.0, "pantowell": 4.5}
+    return {t: Source(set=name, type=t, sval=round(svals[t], 1), sht=shts[t]) for t in SOURCE_TYPES}
+
+def synth_inputs(scale: Scale, seed: int = 0) -> Tuple[Dict[str, Receptor], Dict[str, Barrier], Dict[str, Dict[str, Source]], Dict[str, Param]]:
+    """Generate receptors, barriers, source sets and params for a scale."""
+    rng = random.Random(seed)
+    length = scale.sectors * scale.slen
+
+    barriers = {}
+    for i in range(max(2, scale.params)):
+        b = synth_barrier(f"b{i}", scale.sectors, scale.slen, rng, scale.gaps)
+        barriers[b.key] = b
+    b = synth_barrier("none", scale.sectors, scale.slen, rng, gaps=1.0)
+    barriers[b.key] = b
+
+    sourcesets = {}
+    for i in range(2):
+        sourcesets[f"s{i}"] = synth_sourceset(f"s{i}", rng)
+
+    # Sector s of a param is at x = refpt - (s + 0.5) * slen, so with refpt 0 the track runs
+    # from x = -length to 0 and the receptors are placed alongside it
+    receptors = {}
+    for i in range(scale.receptors):
+        r = Receptor(
+            key=f"r{i}",
+            x=round(rng.uniform(-0.9 * length, -0.1 * length), 1),
+            y=round(rng.choice([1, -1]) * rng.uniform(20, 500), 1),
+            impacts=float(rng.randint(1, 20)),
+        )
+        receptors[r.key] = r
+
+    # The impact position (tlen + pstart + plen) has to fall within the barrier sectors
+    params = {}
+    keys = list(barriers.keys())
+    for i in range(scale.params):
+        dirn = rng.choice(["n", "s"])
+        toffset = rng.choice([2.35, 3.785]) * (1 if dirn == "n" else -1)
+        p = Param(
+            key=f"p{i}",
+            v=rng.choice([2500, 2509, 2510, 2511]),
+            kph=float(rng.choice([300, 320, 330, 342, 360])),
+            rht=4.0,
+            tlen=float(rng.choice([200, 400])),
+            slen=scale.slen,
+            refpt=0.0,
+            dirn=dirn,
+            rstart=round(rng.uniform(0, 0.5) * length, 1),
+            rlen=round(rng.uniform(0, 0.2) * length, 1),
+            pstart=round(rng.uniform(0.3, 0.5) * length, 1),
+            plen=round(rng.uniform(0, 0.1) * length, 1),
+            corr=float(rng.choice([0, 1])),
+            railht=round(rng.uniform(0, 3), 1),
+            toffset=toffset,
+            barrier1=barriers[keys[i % (len(keys) - 1)]],
+            barrier2=barriers[rng.choice(keys)],
+            sources=sourcesets[rng.choice(list(sourcesets.keys()))],
+        )
+        params[p.key] = p
+
+    return (receptors, barriers, sourcesets, params)
+
+def write_inputs_csv(folder: str, prefix: str, receptors, barriers, sourcesets, params) -> Dict[str, str]:
+    """Write inputs in the format read by noiseio, returning the path of each file."""
+    os.makedirs(folder, exist_ok=True)
+    paths = {name: f"{folder}/{prefix}{name}.csv" for name in ("Receptors", "Barriers", "Sources", "Params")}
+
+    def write(path, fieldnames, rows):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    write(paths["Receptors"], ["key", "x", "y", "impacts"],
+          [{"key": r.key, "x": r.x, "y": r.y, "impacts": r.impacts} for r in receptors.values()])
+    write(paths["Barriers"], ["key", "slen", "bht", "bpos"],
+          [{"key": b.key, "slen": b.slen, "bht": "+".join(map(str, b.bht)), "bpos": "+".join(map(str, b.bpos))}
+           for b in barriers.values()])
+    write(paths["Sources"], ["set", "type", "sval", "sht"],
+          [{"set": s.set, "type": s.type, "sval": s.sval, "sht": s.sht} for ss in sourcesets.values() for s in ss.values()])
+
+    fields = ["key", "v", "kph", "rht", "tlen", "slen", "refpt", "dirn", "rstart", "rlen", "pstart", "plen",
+              "corr", "railht", "toffset", "barrier1", "barrier2", "sources"]
+    rows = []
+    for p in params.values():
+        row = {f: getattr(p, f) for f in fields[:-3]}
+        row["barrier1"] = p.barrier1.key
+        row["barrier2"] = p.barrier2.key
+        row["sources"] = next(iter(p.sources.values())).set
+        rows.append(row)
+    write(paths["Params"], fields, rows)
+
+    return paths
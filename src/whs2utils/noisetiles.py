@@ -0,0 +1,345 @@
+import os
+import sys
+import json
+import math
+import zlib
+import struct
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Tuple
+from noisemodels import *
+from noisecore import *
+from noiseio import *
+from noisebackends import get_backend
+from noisespatial import extent, distance
+from noiserun import scenario_key
+
+# Tile pyramid of a noise map for web mapping. The map is the gridded maxdb of a layer's params,
+# the highest over them where there are several, at the centre of each pixel. Tiles are in the
+# model's own frame, x along the track and y the offset from it, and cover a square region that
+# is a single tile at zoom 0 and 2^z by 2^z tiles at zoom z, each of size by size pixels.
+#
+# Tiles are made when first asked for and kept on disk, under {folder}/{z}/{x}/{y}.f32 as little
+# endian float32 rows from the top (highest y) down, with NaN where there is no level, and as
+# colour banded PNGs alongside. Tiles at the highest zoom are evaluated. A tile at a lower zoom is
+# derived from the four tiles below it, averaging the sound energy of each 2 by 2 block of pixels,
+# when those are already made, and is otherwise evaluated at its own coarser pixels, so asking for
+# a low zoom tile doesn't make everything below it. With direct=True lower zooms are always
+# evaluated. Each tile is made under a lock of its own, so a tile being made holds up only the
+# requests for that same tile.
+#
+# index.json describes the pyramid and records a fingerprint for each tile of the inputs of the
+# params that can reach it (all of them, or those within the influence distance of any of its
+# pixels, each pixel then being evaluated against those within the distance of it). A tile whose
+# fingerprint no longer matches is made again, so after a change to the inputs only the regions
+# it affects are recomputed.
+
+# Noise map colour bands, the lower limit in dB of each, below which pixels are left clear
+BANDS = [
+    (45.0, (255, 255, 178)),
+    (50.0, (254, 217, 118)),
+    (55.0, (254, 178, 76)),
+    (60.0, (253, 141, 60)),
+    (65.0, (240, 59, 32)),
+    (70.0, (189, 0, 38)),
+    (75.0, (128, 0, 38)),
+]
+
+def noise_grid(params: List[Param], xs: List[float], ys: List[float], backend=None, sectors=None,
+               influence: float = None) -> List[List[float]]:
+    """maxdb over params (those within influence of each point, if given) at each (x, y) of a grid, as
+    rows for ys. NaN on the track itself and where no param is within influence."""
+    # Only the levels along the route are needed for maxdb, so each pixel is evaluated through
+    # the backend's levels, a scenario at a time where it can, without building the Results
+    backend = backend or get_backend("reference")
+    sects = {}
+    for p in params:
+        sectorcount = len(p.barrier1.bht)
+        sects[p.key] = range(sectorcount) if sectors is None else [s for s in sectors if s < sectorcount]
+
+    grid = []
+    for y in ys:
+        row = []
+        for x in xs:
+            level = math.nan
+            if y != 0:
+                r = Receptor(key="grid", x=x, y=y, impacts=0.0)
+                for p in params:
+                    if influence and distance(p, r) > influence:
+                        continue
+                    # As Impact.maxdb, the highest of the levels rounded as in the Results
+                    maxdb = max(roundTo(db, 2) for db in backend.levels(p, x - p.refpt, y, sects[p.key]))
+                    if not level >= maxdb:
+                        level = maxdb
+            row.append(level)
+        grid.append(row)
+    return grid
+
+def downsample(children: List[array], size: int) -> array:
+    # One tile from its four children (top left, top right, bottom left, bottom right), each
+    # pixel the energy average of the 2 by 2 block below it, ignoring NaN
+    tile = array("f", [math.nan]) * (size * size)
+    half = size // 2
+    for (c, child) in enumerate(children):
+        top = (c // 2) * half
+        left = (c % 2) * half
+        for i in range(half):
+            for j in range(half):
+                levels = [child[(2 * i + di) * size + 2 * j + dj] for di in (0, 1) for dj in (0, 1)]
+                levels = [db for db in levels if db == db]
+                if levels:
+                    tile[(top + i) * size + left + j] = dB(sum(spl(db) for db in levels) / len(levels))
+    return tile
+
+def colour(db: float) -> tuple:
+    rgba = (0, 0, 0, 0)
+    for (lower, rgb) in BANDS:
+        if db >= lower:
+            rgba = rgb + (255,)
+    return rgba
+
+def png(tile: array, size: int) -> bytes:
+    """A tile as an RGBA PNG in the colour bands."""
+    rows = bytearray()
+    for i in range(size):
+        # Each row starts with its filter type, none
+        rows.append(0)
+        for db in tile[i * size:(i + 1) * size]:
+            rows += bytes(colour(db))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(bytes(rows), 9))
+            + chunk(b"IEND", b""))
+
+def bounds_of(params: List[Param], margin: float) -> Tuple[float, float, float, float]:
+    """(xmin, ymin, xmax, ymax) covering the track of the params and margin either side."""
+    extents = [extent(p) for p in params]
+    return (min(start for (start, _) in extents) - margin, -margin,
+            max(end for (_, end) in extents) + margin, margin)
+
+class TilePyramid:
+
+    def __init__(self, params: Dict[str, Param], folder: str, layer: str = "max", bounds=None, levels: int = 6,
+                 size: int = 256, backend: str = "scalar", influence: float = None, direct: bool = False,
+                 margin: float = 1000.0, sectors=None):
+        if size < 2 or size % 2:
+            raise ValueError(f"Tile size must be even, not {size}")
+        if levels < 1:
+            raise ValueError(f"A pyramid needs at least one level, not {levels}")
+        if layer == "max":
+            self.params = list(params.values())
+        elif layer in params:
+            self.params = [params[layer]]
+        else:
+            raise ValueError(f"Unknown layer {layer}, expected a param key or max")
+
+        self.folder = folder
+        self.layer = layer
+        self.levels = levels
+        self.size = size
+        self.backend = backend
+        self.influence = influence
+        self.direct = direct
+        self.sectors = sectors
+
+        # A square region around the bounds, so pixels are square at every zoom
+        (xmin, ymin, xmax, ymax) = bounds or bounds_of(self.params, margin)
+        self.side = max(xmax - xmin, ymax - ymin)
+        self.x0 = (xmin + xmax - self.side) / 2
+        self.y0 = (ymin + ymax + self.side) / 2
+
+        # The inputs of each param other than its key, for the fingerprints
+        none = Receptor(key="", x=0.0, y=0.0, impacts=0.0)
+        self.inputs = {p.key: repr(scenario_key(none, p)[2:]) for p in self.params}
+
+        # self.lock guards the index and the per-tile locks, each tile is made under its own
+        self.lock = threading.Lock()
+        self.locks: Dict[str, threading.Lock] = {}
+        # Fingerprints by the params reaching a tile, which with the inputs fixed for the pyramid
+        # only change with its extent
+        self.fingerprints: Dict[tuple, str] = {}
+        self.computed = 0
+        self.reused = 0
+        self.index = {"tiles": {}}
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(self.index_path()):
+            with open(self.index_path(), encoding="utf-8") as f:
+                self.index = json.load(f)
+            if self.index.get("grid") != self.grid():
+                # A different grid, none of the tiles can be used
+                self.index = {"tiles": {}}
+        self.index["grid"] = self.grid()
+
+    def grid(self) -> dict:
+        return {"layer": self.layer, "x0": self.x0, "y0": self.y0, "side": self.side, "levels": self.levels,
+                "size": self.size, "backend": self.backend, "influence": self.influence, "direct": self.direct,
+                "sectors": self.sectors}
+
+    def index_path(self) -> str:
+        return f"{self.folder}/index.json"
+
+    def tile_bounds(self, z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+        """(xmin, ymin, xmax, ymax) of a tile, y counting down from the top of the region."""
+        width = self.side / 2 ** z
+        return (self.x0 + x * width, self.y0 - (y + 1) * width, self.x0 + (x + 1) * width, self.y0 - y * width)
+
+    def reaching(self, z: int, x: int, y: int) -> List[Param]:
+        # The params whose track comes within the influence distance of a tile
+        if not self.influence:
+            return self.params
+        (xmin, ymin, xmax, ymax) = self.tile_bounds(z, x, y)
+        near = []
+        for p in self.params:
+            (start, end) = extent(p)
+            dx = max(start - xmax, 0.0, xmin - end)
+            dy = max(ymin, 0.0, -ymax)
+            if math.sqrt(dx ** 2 + dy ** 2) <= self.influence:
+                near.append(p)
+        return near
+
+    def fingerprint(self, z: int, x: int, y: int) -> str:
+        keys = tuple(p.key for p in self.reaching(z, x, y))
+        if keys not in self.fingerprints:
+            inputs = [self.inputs[key] for key in keys]
+            self.fingerprints[keys] = hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+        return self.fingerprints[keys]
+
+    def path(self, z: int, x: int, y: int, ext: str) -> str:
+        return f"{self.folder}/{z}/{x}/{y}.{ext}"
+
+    def check(self, z: int, x: int, y: int) -> None:
+        if not 0 <= z < self.levels:
+            raise ValueError(f"Zoom {z} is outside the pyramid's levels 0 to {self.levels - 1}")
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {x}/{y} is outside zoom {z}")
+
+    def tile_lock(self, z: int, x: int, y: int) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(f"{z}/{x}/{y}", threading.Lock())
+
+    def made(self, z: int, x: int, y: int) -> bool:
+        """Whether a tile is on disk and made from the current inputs."""
+        with self.lock:
+            entry = self.index["tiles"].get(f"{z}/{x}/{y}")
+        return (entry is not None and entry["fingerprint"] == self.fingerprint(z, x, y)
+                and os.path.exists(self.path(z, x, y, "f32")))
+
+    def tile(self, z: int, x: int, y: int) -> array:
+        """The levels of a tile, made if it isn't on disk or its inputs have changed."""
+        self.check(z, x, y)
+        with self.tile_lock(z, x, y):
+            if self.made(z, x, y):
+                with self.lock:
+                    self.reused += 1
+                return self.read(z, x, y)
+
+            children = [(z + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]
+            if z < self.levels - 1 and not self.direct and all(self.made(*child) for child in children):
+                tile = downsample([self.tile(*child) for child in children], self.size)
+            else:
+                tile = self.evaluate(z, x, y)
+            self.write(z, x, y, tile)
+
+            levels = [db for db in tile if db == db]
+            with self.lock:
+                self.computed += 1
+                self.index["tiles"][f"{z}/{x}/{y}"] = {
+                    "fingerprint": self.fingerprint(z, x, y),
+                    "min": round(min(levels), 2) if levels else None,
+                    "max": round(max(levels), 2) if levels else None,
+                }
+            return tile
+
+    def png(self, z: int, x: int, y: int) -> bytes:
+        """A tile as a colour banded PNG."""
+        tile = self.tile(z, x, y)
+        with self.tile_lock(z, x, y):
+            path = self.path(z, x, y, "png")
+            if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(self.path(z, x, y, "f32")):
+                with open(path, "rb") as f:
+                    return f.read()
+            data = png(tile, self.size)
+            with open(path, "wb") as f:
+                f.write(data)
+            return data
+
+    def evaluate(self, z: int, x: int, y: int) -> array:
+        (xmin, _, xmax, ymax) = self.tile_bounds(z, x, y)
+        pixel = (xmax - xmin) / self.size
+        xs = [xmin + (j + 0.5) * pixel for j in range(self.size)]
+        ys = [ymax - (i + 0.5) * pixel for i in range(self.size)]
+        params = self.reaching(z, x, y)
+        tile = array("f")
+        if not params:
+            return array("f", [math.nan]) * (self.size * self.size)
+        for row in noise_grid(params, xs, ys, get_backend(self.backend), self.sectors, self.influence):
+            tile.extend(row)
+        return tile
+
+    def read(self, z: int, x: int, y: int) -> array:
+        tile = array("f")
+        with open(self.path(z, x, y, "f32"), "rb") as f:
+            tile.frombytes(f.read())
+        if sys.byteorder == "big":
+            tile.byteswap()
+        return tile
+
+    def write(self, z: int, x: int, y: int, tile: array) -> None:
+        os.makedirs(os.path.dirname(self.path(z, x, y, "f32")), exist_ok=True)
+        if sys.byteorder == "big":
+            tile = array("f", tile)
+            tile.byteswap()
+        with open(self.path(z, x, y, "f32"), "wb") as f:
+            f.write(tile.tobytes())
+
+    def flush(self) -> None:
+        """Write the index of the tiles made so far."""
+        with self.lock:
+            self.index["format"] = "float32 little endian, rows from the top, NaN where there is no level"
+            self.index["bands"] = [{"db": lower, "rgb": list(rgb)} for (lower, rgb) in BANDS]
+            with open(self.index_path(), "w", encoding="utf-8") as f:
+                json.dump(self.index, f, indent=2)
+
+    def tiles_in(self, z: int, bbox=None) -> List[Tuple[int, int]]:
+        """The (x, y) of the tiles at zoom z overlapping bbox (xmin, ymin, xmax, ymax), or all of them."""
+        n = 2 ** z
+        if bbox is None:
+            return [(x, y) for y in range(n) for x in range(n)]
+        width = self.side / n
+        (xmin, ymin, xmax, ymax) = bbox
+        xs = range(max(0, math.floor((xmin - self.x0) / width)), min(n, math.ceil((xmax - self.x0) / width)))
+        ys = range(max(0, math.floor((self.y0 - ymax) / width)), min(n, math.ceil((self.y0 - ymin) / width)))
+        return [(x, y) for y in ys for x in xs]
+
+def export(barriers_csv: str, sources_csv: str, params_csv: str, layers=("max",),
+           zoom: int = None, levels: int = 6, size: int = 256, bbox=None, margin: float = 1000.0,
+           influence: float = None, direct: bool = False, backend: str = "scalar", outdir: str = "noisedata",
+           fmt: str = "png") -> None:
+    # Make the tiles of each layer down to zoom (the highest by default) over bbox, reusing those
+    # already made whose inputs haven't changed
+    barriers = load_barriers_csv(barriers_csv)
+    sourcesets = load_sourcesets_csv(sources_csv)
+    params = load_params_csv(params_csv, barriers, sourcesets)
+
+    zoom = levels - 1 if zoom is None else zoom
+    for layer in layers:
+        pyramid = TilePyramid(params, f"{outdir}/tiles/{layer}", layer=layer, levels=levels, size=size,
+                              backend=backend, influence=influence, direct=direct, margin=margin)
+        try:
+            # Highest zoom first, so the tiles below each lower zoom one are there to derive it from
+            for z in reversed(range(zoom + 1)):
+                for (x, y) in pyramid.tiles_in(z, bbox):
+                    if fmt == "png":
+                        pyramid.png(z, x, y)
+                    else:
+                        pyramid.tile(z, x, y)
+                pyramid.flush()
+                print(f"Layer {layer} zoom {z}: {pyramid.computed} tiles made, {pyramid.reused} reused")
+        finally:
+            pyramid.flush()
+        print(f"Wrote {pyramid.folder}/index.json")
@@ -0,0 +1,89 @@
+import os
+import json
+from typing import Iterable
+
+class Tracer:
+    # Structured trace of the intermediate terms of the noise model, replacing the old
+    # per-call debug logging. The model functions only test `tracer.active` so tracing
+    # costs one attribute lookup per call when it is off. When on, it is limited to the
+    # receptors, params, sensitivity variants and sectors given to configure() and each
+    # record is written as one JSON object per line.
+
+    def __init__(self):
+        self.enabled = False
+        self.selected = False
+        self.active = False
+        self.file = None
+        self.receptors = None
+        self.params = None
+        self.variants = None
+        self.sectors = None
+        self.context = {}
+
+    def configure(self, path: str, receptors: Iterable[str] = None, params: Iterable[str] = None,
+                  variants: Iterable[str] = None, sectors: Iterable[int] = None) -> None:
+        """Turn tracing on, writing to path. A filter left as None matches everything."""
+        self.close()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "w", encoding="utf-8")
+        self.receptors = set(receptors) if receptors else None
+        self.params = set(params) if params else None
+        self.variants = set(variants) if variants else None
+        self.sectors = set(sectors) if sectors else None
+        self.enabled = True
+        self.context = {}
+        self.selected = False
+        self.active = False
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+        self.file = None
+        self.enabled = False
+        self.selected = False
+        self.active = False
+        self.context = {}
+
+    def scope(self, receptor: str, param: str, variant: str) -> None:
+        """Set the (receptor, param, variant) unit being evaluated."""
+        if not self.enabled:
+            return
+        self.context = {"receptor": receptor, "param": param, "variant": variant, "sect": None}
+        self.selected = ((self.receptors is None or receptor in self.receptors)
+                         and (self.params is None or param in self.params)
+                         and (self.variants is None or variant in self.variants))
+        self.active = self.selected and self.sectors is None
+
+    def sector(self, sect) -> None:
+        """Set the train position sector being evaluated, or None for the impact position."""
+        if not self.enabled or not self.context:
+            return
+        self.context["sect"] = sect
+        self.active = self.selected and (self.sectors is None or sect in self.sectors)
+
+    def emit(self, event: str, **terms) -> None:
+        record = dict(self.context)
+        record["event"] = event
+        record.update(terms)
+        self.file.write(json.dumps(record) + "\n")
+
+tracer = Tracer()
+
+def parse_sectors(values: Iterable[str]) -> set:
+    """Convert sector selections such as 10, 10-20 (inclusive) or -20 (from 0) into a set of sectors."""
+    sectors = set()
+    for value in values:
+        try:
+            if "-" in value:
+                (lo, hi) = value.split("-", 1)
+                # An open start counts from the first sector, but the last isn't known here
+                (lo, hi) = (int(lo) if lo.strip() else 0, int(hi))
+                if lo > hi:
+                    raise ValueError()
+                sectors.update(range(lo, hi + 1))
+            else:
+                sectors.add(int(value))
+        except ValueError:
+            raise ValueError(f"Invalid sector selection {value}, expected a sector such as 10, "
+                             f"a range such as 10-20 or one from the first sector such as -20")
+    return sectors
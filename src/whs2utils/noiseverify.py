@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from typing import Dict, List
+from noisemodels import *
+from noiseio import *
+from noisesynth import *
+from noisebackends import get_backend
+import noiserun
+
+# Differential verification of a compute backend against the reference backend. Every
+# (receptor, param) scenario is run through both and the output fields compared in dB.
+
+# Maximum deviation allowed per output field, in dB. The outputs are rounded to 2 places
+# so a difference of one in the last place is always allowed.
+TOLERANCES = {
+    "Result.db": 0.01,
+    "Result.spl": 0.01,
+    "Impact.db": 0.01,
+    "Impact.maxdb": 0.01,
+    "Impact.sumspl": 0.01,
+}
+
+# Linear levels are compared in dB, floored at 0 dB so that values which round to
+# zero don't show up as huge deviations
+SPL_FLOOR = 1.0
+
+@dataclass
+class Deviation:
+    field: str
+    count: int
+    max: float
+    mean: float
+    tolerance: float
+    passed: bool
+
+def deviation(field: str, a: float, b: float) -> float:
+    if a != a and b != b:
+        # Both NaN, which the reference can produce for a degenerate barrier
+        return 0.0
+    if field.endswith("spl"):
+        return abs(dB(max(a, SPL_FLOOR)) - dB(max(b, SPL_FLOOR)))
+    return abs(a - b)
+
+def verify(backend: str, receptors: Dict[str, Receptor], params: Dict[str, Param],
+           tolerances: Dict[str, float] = None) -> List[Deviation]:
+    """Compare a backend with the reference over every receptor and param."""
+    reference = get_backend("reference")
+    candidate = get_backend(backend)
+    # An approximate backend is held to the deviation it allows itself, on top of the rounding
+    tolerances = {**{field: tol + candidate.tolerance for (field, tol) in TOLERANCES.items()}, **(tolerances or {})}
+
+    devs = {field: [] for field in tolerances}
+    for r in receptors.values():
+        for p in params.values():
+            (ref_results, ref_impact) = noiserun.runscenario("verify", r, p, reference)
+            (results, impact) = noiserun.runscenario("verify", r, p, candidate)
+
+            for (a, b) in zip(ref_results, results):
+                devs["Result.db"].append(deviation("db", a.db, b.db))
+                devs["Result.spl"].append(deviation("spl", a.spl, b.spl))
+            devs["Impact.db"].append(deviation("db", ref_impact.db, impact.db))
+            devs["Impact.maxdb"].append(deviation("db", ref_impact.maxdb, impact.maxdb))
+            devs["Impact.sumspl"].append(deviation("spl", ref_impact.sumspl, impact.sumspl))
+
+    report = []
+    for (field, values) in devs.items():
+        # A NaN deviation (e.g. from a NaN barrier attenuation) has to count as the worst
+        worst = float("nan") if any(v != v for v in values) else max(values, default=0.0)
+        report.append(Deviation(
+            field=field,
+            count=len(values),
+            max=worst,
+            mean=sum(values) / len(values) if values else 0.0,
+            tolerance=tolerances[field],
+            passed=worst <= tolerances[field] + EPS,
+        ))
+    return report
+
+def verify_synthetic(backend: str, scale: str = "small", seeds: List[int] = (0,)) -> List[Deviation]:
+    """Verify over generated inputs, combining the scenarios from each seed."""
+    receptors = {}
+    params = {}
+    for seed in seeds:
+        (r, _, _, p) = synth_inputs(SCALES[scale], seed)
+        receptors.update({f"{seed}.{k}": v for (k, v) in r.items()})
+        params.update({f"{seed}.{k}": v for (k, v) in p.items()})
+    return verify(backend, receptors, params)
+
+def verify_files(backend: str, receptors_csv: str, barriers_csv: str, sources_csv: str, params_csv: str) -> List[Deviation]:
+    """Verify over real inputs."""
+    receptors = load_receptors_csv(receptors_csv)
+    barriers = load_barriers_csv(barriers_csv)
+    sourcesets = load_sourcesets_csv(sources_csv)
+    params = load_params_csv(params_csv, barriers, sourcesets)
+    return verify(backend, receptors, params)
+
+def print_report(backend: str, report: List[Deviation]) -> bool:
+    print(f"Backend {backend} against reference")
+    for d in report:
+        print(f"{d.field:14} n={d.count:<8} max={d.max:.4f} mean={d.mean:.6f} tol={d.tolerance} {'ok' if d.passed else 'FAIL'}")
+    return all(d.passed for d in report)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The model modules import each other as top level modules, as they do when run from src/whs2utils
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "whs2utils"))
@@ -0,0 +1,35 @@
+import math
+from noisemodels import *
+from noisesynth import SCALES, synth_inputs
+from noisespatial import SegmentIndex
+from noiserun import ScenarioCache
+from noiseaggregate import runtimetable
+
+def inputs():
+    (receptors, _, _, params) = synth_inputs(SCALES["small"], seed=0)
+    # A receptor well beyond the influence distance of every param
+    receptors["far"] = Receptor(key="far", x=-750.0, y=5000.0, impacts=3.0)
+    passes = [Pass(key=f"t{i}", param=p.key, variant="", day=40.0, evening=10.0, night=2.0)
+              for (i, p) in enumerate(params.values())]
+    return (receptors, params, passes)
+
+def test_receptor_without_near_params_has_no_exposure():
+    (receptors, params, passes) = inputs()
+    index = SegmentIndex(params, 1000.0)
+    assert not index.near(receptors["far"])
+
+    exposures = runtimetable("test", receptors.values(), params, passes, ScenarioCache(), index)
+
+    assert [e.receptor for e in exposures] == [k for k in receptors if k != "far"]
+    for e in exposures:
+        assert e.day > 0
+        for level in (e.laeqday, e.laeqevening, e.laeqnight, e.laeq16h, e.lden):
+            assert math.isfinite(level) and level > 0
+
+def test_exposure_without_influence_covers_every_receptor():
+    (receptors, params, passes) = inputs()
+
+    exposures = runtimetable("test", receptors.values(), params, passes, ScenarioCache())
+
+    assert [e.receptor for e in exposures] == list(receptors)
+    assert all(e.day == sum(ps.day for ps in passes) for e in exposures)
@@ -0,0 +1,33 @@
+from dataclasses import replace
+from noisemodels import *
+from noisecore import getAngles
+from noisesynth import SCALES, synth_inputs
+from noisebackends import get_backend
+from noiserun import runscenario
+import noisekernel
+
+def mixed_barrier(key: str, slen: float, sectors: int) -> Barrier:
+    # Long stretches, gaps and a broken up stretch of single sector runs
+    bht = [3.0] * 30 + [0.0] * 6 + [4.0, 2.0, 5.0, 2.0, 6.0, 3.0, 4.0, 5.0] + [2.0] * 20 + [0.0] * 10 + [5.0] * 50
+    bpos = [5.0] * 30 + [0.0] * 6 + [4.0, 8.0, 5.0, 6.0, 4.0, 8.0, 5.0, 6.0] + [6.0] * 20 + [0.0] * 10 + [4.0] * 50
+    bht = (bht * (sectors // len(bht) + 1))[:sectors]
+    bpos = (bpos * (sectors // len(bpos) + 1))[:sectors]
+    return Barrier(key=key, slen=slen, bht=bht, bpos=bpos, angles=getAngles(slen, bpos), runs=barrier_runs(bht, bpos))
+
+def scenarios():
+    (receptors, _, _, params) = synth_inputs(SCALES["small"], seed=0)
+    for p in params.values():
+        sectors = len(p.barrier1.bht)
+        q = replace(p, barrier1=mixed_barrier("mixed1", p.slen, sectors), barrier2=mixed_barrier("mixed2", p.slen, sectors))
+        for r in receptors.values():
+            yield (r, q)
+
+def test_runs_give_the_same_outputs_as_the_angles_scan(monkeypatch):
+    backend = get_backend("scalar")
+    for (r, p) in scenarios():
+        monkeypatch.setattr(noisekernel, "compact", lambda runs, sectors: True)
+        from_runs = runscenario("test", r, p, backend)
+        monkeypatch.setattr(noisekernel, "compact", lambda runs, sectors: False)
+        from_angles = runscenario("test", r, p, backend)
+        reference = runscenario("test", r, p)
+        assert from_runs == from_angles == reference